@@ -1,4 +1,6 @@
 __version__ = '0.1.2'
 
-from .archive import Archive
+from .archive import Archive, ArchiveStream, CompressionPolicy
 from .repository import Repository
+from .manager import RepositoryManager
+from .mirror import MirrorCache
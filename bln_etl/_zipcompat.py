@@ -0,0 +1,128 @@
+"""Helpers for the few zip operations zipfile has no public API for
+
+Writing already-compressed members, dropping a member from an open
+zip and copying members as-is all need zipfile internals, which
+change between Python versions. They are kept here, behind small
+functions, so archive.py only uses the public API and any breakage
+shows up in tests/test_zipcompat.py on every supported version.
+"""
+import struct
+import zipfile
+from zipfile import ZipInfo, ZIP_LZMA
+
+
+# Local file header: signature, versions, flags, compression, time,
+# date, CRC, sizes, then the lengths of the name and extra fields
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\003\004'
+
+# Header id of the Zip64 field in a member's extra block
+ZIP64_EXTRA_ID = 0x0001
+
+# General purpose flag bits
+FLAG_LZMA_EOS = 0x02
+FLAG_DATA_DESCRIPTOR = 0x08
+
+
+def set_compression(zinfo, compress_type, compresslevel):
+    """Set a member's compression type and level.
+
+    The level became the public ZipInfo.compress_level in Python 3.13.
+    """
+    zinfo.compress_type = compress_type
+    if hasattr(ZipInfo, 'compress_level'):
+        zinfo.compress_level = compresslevel
+    else:
+        zinfo._compresslevel = compresslevel
+
+
+def get_compressor(compress_type, compresslevel=None):
+    """Compressor zipfile would use for a member, or None when stored.
+
+    Returns an object with compress() and flush() methods.
+    """
+    return zipfile._get_compressor(compress_type, compresslevel)
+
+
+def write_compressed(zfile, zinfo, data, chunk_size):
+    """Write an already compressed member to a ZipFile open for writing.
+
+    "zinfo" must carry the member's CRC and sizes. Its compressed bytes
+    are read from the current position of the "data" file object. This
+    mirrors ZipFile._open_to_write, minus the compression step.
+    """
+    # Sizes and CRC go in the local header, so no data descriptor
+    zinfo.flag_bits &= ~FLAG_DATA_DESCRIPTOR
+    if zinfo.compress_type == ZIP_LZMA:
+        # Compressed data includes an end-of-stream (EOS) marker
+        zinfo.flag_bits |= FLAG_LZMA_EOS
+    if not zinfo.external_attr:
+        zinfo.external_attr = 0o600 << 16
+    with zfile._lock:
+        if zfile._writing:
+            raise ValueError("Can't write to the ZIP file while another write handle is open")
+        if zfile._seekable:
+            zfile.fp.seek(zfile.start_dir)
+        zinfo.header_offset = zfile.fp.tell()
+        zfile._writecheck(zinfo)
+        zfile._didModify = True
+        zfile.fp.write(zinfo.FileHeader())
+        remaining = zinfo.compress_size
+        while remaining:
+            chunk = data.read(min(chunk_size, remaining))
+            if not chunk:
+                raise EOFError(f"Compressed data for {zinfo.filename} ended early")
+            zfile.fp.write(chunk)
+            remaining -= len(chunk)
+        zfile.filelist.append(zinfo)
+        zfile.NameToInfo[zinfo.filename] = zinfo
+        zfile.start_dir = zfile.fp.tell()
+
+
+def remove_member(zfile, zinfo):
+    """Drop a member from a ZipFile open in append mode.
+
+    Only the central directory entry goes, so the member's bytes stay in
+    the file unless it was the last member, in which case later writes
+    and the central directory go over it.
+    """
+    zfile.filelist.remove(zinfo)
+    if zfile.NameToInfo.get(zinfo.filename) is zinfo:
+        del zfile.NameToInfo[zinfo.filename]
+    if all(info.header_offset < zinfo.header_offset for info in zfile.filelist):
+        zfile.start_dir = zinfo.header_offset
+    zfile._didModify = True
+
+
+def copy_member(src, zinfo, dest, chunk_size):
+    """Copy a member's compressed bytes from one ZipFile to another as-is."""
+    seek_member_data(src.fp, zinfo)
+    # Any Zip64 extra is regenerated by FileHeader as needed
+    zinfo.extra = strip_extra(zinfo.extra, ZIP64_EXTRA_ID)
+    write_compressed(dest, zinfo, src.fp, chunk_size)
+
+
+def seek_member_data(fileobj, zinfo):
+    """Position a zip's file object at the start of a member's data."""
+    fileobj.seek(zinfo.header_offset)
+    header = LOCAL_HEADER.unpack(fileobj.read(LOCAL_HEADER.size))
+    if header[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local file header for {zinfo.filename}")
+    # Skip the name and extra fields, which can differ from the
+    # central directory's copies
+    fileobj.seek(header[-2] + header[-1], 1)
+
+
+def strip_extra(extra, header_id):
+    """Remove fields with the given header id from a zip extra block."""
+    kept = []
+    pos = 0
+    while pos + 4 <= len(extra):
+        field_id, size = struct.unpack('<HH', extra[pos:pos + 4])
+        end = pos + 4 + size
+        if field_id != header_id:
+            kept.append(extra[pos:end])
+        pos = end
+    # Keep any trailing bytes too short to be a field
+    kept.append(extra[pos:])
+    return b''.join(kept)
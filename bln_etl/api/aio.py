@@ -0,0 +1,208 @@
+"""Async counterparts of the BLN API wrappers
+
+Calls go through the same pooled, retrying Base.post as the sync
+client, run on a thread pool so many requests can be in flight at once.
+No extra dependencies are needed.
+
+USAGE:
+    import asyncio
+    from bln_etl.api.aio import Client
+
+    async def main():
+        client = Client()
+        projects = await client.user_projects()
+        files = await asyncio.gather(*[p.files() for p in projects])
+
+    asyncio.run(main())
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import client as sync
+from .client import (
+    _batch_nodes,
+    _batches,
+    _delete_file_request,
+    _file_names,
+    _files_request,
+    _open_projects_page,
+    _page_request,
+    _project_batch_request,
+    _project_node,
+    _project_request,
+    _user_projects_page,
+)
+from .queries import OPEN_PROJECTS_QUERY, USER_PROJECTS_QUERY
+
+
+class Engine:
+    """Run blocking API calls with at most "concurrency" in flight.
+
+    The engine can be shared by several event loops (e.g. successive
+    asyncio.run calls); each loop gets its own semaphore.
+    """
+
+    def __init__(self, concurrency=10):
+        self.concurrency = concurrency
+        self._executor = None
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency,
+                    thread_name_prefix='bln-api'
+                )
+            return self._executor
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                # Drop semaphores of loops that have gone away
+                self._semaphores = {
+                    other: s for other, s in self._semaphores.items() if not other.is_closed()
+                }
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+            return semaphore
+
+    async def run(self, func, *args, **kwargs):
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            call = functools.partial(func, *args, **kwargs)
+            return await loop.run_in_executor(self.executor, call)
+
+    async def post(self, api_token, data):
+        return await self.run(sync.Base.post, api_token, data)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+# Engine shared by all async API objects unless one is passed in
+default_engine = Engine()
+
+
+class Client(sync.Client):
+
+    def __init__(self, api_token=None, engine=None):
+        super().__init__(api_token)
+        self.engine = engine or default_engine
+
+    async def user_projects(self):
+        return [project async for project in self.iter_user_projects()]
+
+    async def open_projects(self):
+        return [project async for project in self.iter_open_projects()]
+
+    async def iter_user_projects(self, page_size=None):
+        pages = self._iter_pages(USER_PROJECTS_QUERY, _user_projects_page, page_size)
+        async for node in pages:
+            yield self._project(node)
+
+    async def iter_open_projects(self, page_size=None):
+        pages = self._iter_pages(OPEN_PROJECTS_QUERY, _open_projects_page, page_size)
+        async for node in pages:
+            yield self._project(node)
+
+    async def _iter_pages(self, query, parse, page_size):
+        after = None
+        while True:
+            data = _page_request(query, page_size or self.page_size, after)
+            nodes, after = parse(await self.engine.post(self.api_token, data))
+            for node in nodes:
+                yield node
+            if after is None:
+                return
+
+    def _project(self, node):
+        project = self._build_project(node, Project)
+        project.engine = self.engine
+        return project
+
+
+class File(sync.File):
+
+    engine = default_engine
+
+    async def delete(self):
+        data = _delete_file_request(self.project_id, self.name)
+        try:
+            return await self.engine.post(self.api_token, data)
+        finally:
+            self._cache_delete(self.api_token, self.project_id)
+
+
+class Project(sync.Project):
+
+    engine = default_engine
+
+    @classmethod
+    async def get(cls, uuid, api_token=None, fields=None):
+        cls.set_api_token(api_token)
+        project_node = None
+        if fields is None:
+            project_node = cls._cache_get('project', cls.api_token, uuid)
+        if project_node is None:
+            response = await cls.engine.post(cls.api_token, _project_request(uuid, fields))
+            project_node = _project_node(response)
+            if project_node and fields is None:
+                cls._cache_set('project', cls.api_token, uuid, project_node)
+        if project_node:
+            return cls._build_project(project_node, cls)
+
+    @classmethod
+    async def get_many(cls, uuids, api_token=None, batch_size=None, fields=None):
+        """Look up many projects, sending batches concurrently."""
+        cls.set_api_token(api_token)
+
+        async def get_batch(batch):
+            request = _project_batch_request(batch, fields)
+            response = await cls.engine.post(cls.api_token, request)
+            return [
+                cls._build_project(node, cls) if node else None
+                for node in _batch_nodes(response, len(batch))
+            ]
+
+        batches = await asyncio.gather(*[
+            get_batch(batch)
+            for batch in _batches(uuids, batch_size or cls.batch_size)
+        ])
+        return [project for batch in batches for project in batch]
+
+    @classmethod
+    async def create(cls, name, api_token=None, meta={}):
+        return await cls.engine.run(super().create, name, api_token=api_token, meta=meta)
+
+    async def files(self):
+        names = self._cache_get('files', self.api_token, self.id)
+        if names is None:
+            response = await self.engine.post(self.api_token, _files_request(self.id))
+            names = _file_names(response)
+            self._cache_set('files', self.api_token, self.id, names)
+        files = []
+        for name in names:
+            f = File(self.api_token, self.id, name)
+            f.engine = self.engine
+            files.append(f)
+        return files
+
+    async def upload_files(self, files, concurrency=None, retries=None,
+                           progress=None, resumable=None):
+        upload = functools.partial(
+            super().upload_files,
+            concurrency=concurrency,
+            retries=retries,
+            progress=progress,
+            resumable=resumable
+        )
+        return await self.engine.run(upload, files)
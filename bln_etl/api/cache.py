@@ -0,0 +1,81 @@
+"""Expiring cache for API responses
+"""
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+class TTLCache:
+    """Thread-safe cache whose entries expire after "ttl" seconds.
+
+    Pass a "path" to also keep entries in a JSON file, so separate
+    short-lived processes can reuse them. Only raw response data is
+    stored; keys hold a hash of the API token, never the token itself.
+
+    USAGE:
+        from bln_etl.api.client import Base
+        from bln_etl.api.cache import TTLCache
+
+        Base.cache = TTLCache(ttl=300, path='~/.cache/bln_etl/api.json')
+    """
+
+    def __init__(self, ttl=60, path=None):
+        self.ttl = ttl
+        self.path = Path(path).expanduser() if path else None
+        self._entries = {}
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except ValueError:
+                self._entries = {}
+
+    def get(self, key):
+        """Cached value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            return copy.deepcopy(value)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = [time.time() + self.ttl, copy.deepcopy(value)]
+            self._save()
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        now = time.time()
+        entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file first so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=str(self.path.parent), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp, str(self.path))
+
+
+def cache_key(kind, api_token, item_id):
+    token_hash = hashlib.sha256(api_token.encode('utf-8')).hexdigest()[:16]
+    return f"{kind}:{token_hash}:{item_id}"
@@ -1,31 +1,81 @@
 """Light-weight BLN API wrappers to simplify CRUD
 """
+import functools
+import gzip
+import hashlib
+import json
 import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 
-from bln.client import Client as BlnClient, _upload_file
+from bln.client import Client as BlnClient
 
 from bln_etl.utils import (
     snake_to_camel_case
 )
 
+from .cache import TTLCache, cache_key
 from .queries import (
+    CREATE_FILE_UPLOAD_URI_QUERY,
     DELETE_FILE_QUERY,
     OPEN_PROJECTS_QUERY,
-    PROJECT_QUERY,
     PROJECT_FILES_QUERY,
     USER_PROJECTS_QUERY,
+    project_batch_query,
+    project_query,
 )
 
 
 ENDPOINT = 'https://api.biglocalnews.org/graphql'
 
+# Transient errors worth retrying
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+UploadResult = namedtuple('UploadResult', ['path', 'name', 'ok', 'attempts', 'error'])
+
 
 class ApiError(Exception): pass
 class ConfigurationError(Exception): pass
 
 
 class Base:
+    """Shared plumbing for API classes.
+
+    Requests go through one pooled requests.Session per API token, so
+    repeated calls reuse connections. Queries (but not mutations) are
+    retried with exponential backoff on connection errors, timeouts and
+    transient 5xx/429 responses. Tune behavior via class attributes,
+    e.g. Base.timeout = 60.
+
+    Project lookups and file listings are kept in "cache" (a TTLCache,
+    or None to disable caching).
+
+    Two opt-in settings shrink request payloads, for servers that
+    support them: "persisted_queries" sends a sha256 hash in place of
+    the query text (Automatic Persisted Queries), and "compress_requests"
+    gzips request bodies of at least "compress_min_size" bytes.
+    """
+
+    endpoint = ENDPOINT
+    # Seconds to wait for a response
+    timeout = 30
+    # Retries for queries, sleeping backoff_factor * 2^n seconds between tries
+    max_retries = 3
+    backoff_factor = 0.5
+    # Connections kept alive per session
+    pool_size = 10
+    cache = TTLCache(ttl=60)
+    persisted_queries = False
+    compress_requests = False
+    compress_min_size = 1024
+
+    _sessions = {}
+    _sessions_lock = threading.Lock()
 
     @classmethod
     def set_api_token(cls, api_token=None):
@@ -42,14 +92,99 @@ class Base:
                 raise ConfigurationError(msg)
 
     @classmethod
-    def post(cls, api_token, data):
-        headers = {'Authorization': f'JWT {api_token}'}
-        resp = requests.post(
-            ENDPOINT,
-            json=data,
-            headers=headers
-        )
-        return resp.json()
+    def session(cls, api_token, auth_method='JWT'):
+        """Shared requests.Session for an API token."""
+        key = (auth_method, api_token)
+        with Base._sessions_lock:
+            session = Base._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                session.headers['Authorization'] = f'{auth_method} {api_token}'
+                adapter = HTTPAdapter(
+                    pool_connections=cls.pool_size,
+                    pool_maxsize=cls.pool_size
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                Base._sessions[key] = session
+        return session
+
+    @classmethod
+    def close_sessions(cls):
+        with Base._sessions_lock:
+            for session in Base._sessions.values():
+                session.close()
+            Base._sessions.clear()
+
+    @classmethod
+    def post(cls, api_token, data, endpoint=None, auth_method='JWT'):
+        """Send a GraphQL request and return the decoded response.
+
+        "endpoint" defaults to cls.endpoint. "auth_method" is the
+        Authorization scheme sent with the token.
+        """
+        auth = (endpoint or cls.endpoint, auth_method)
+        # Mutations aren't idempotent, so only retry queries
+        retries = 0 if _is_mutation(data) else cls.max_retries
+        if cls.persisted_queries:
+            persisted = _persisted(data)
+            response = cls._send(api_token, persisted, retries, *auth)
+            if not _persisted_query_not_found(response):
+                return response
+            # Unknown hash: send the text once more so the server registers it
+            data = dict(persisted, query=data['query'])
+        return cls._send(api_token, data, retries, *auth)
+
+    @classmethod
+    def _send(cls, api_token, data, retries, endpoint, auth_method):
+        session = cls.session(api_token, auth_method)
+        request = cls._encode(data)
+        for attempt in range(retries + 1):
+            try:
+                resp = session.post(endpoint, timeout=cls.timeout, **request)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+            else:
+                if resp.status_code not in RETRY_STATUSES:
+                    return resp.json()
+                if attempt == retries:
+                    raise ApiError(f"{resp.status_code} response from {endpoint}")
+            time.sleep(cls.backoff_factor * 2 ** attempt)
+
+    @classmethod
+    def _encode(cls, data):
+        """Keyword arguments for session.post carrying "data"."""
+        if cls.compress_requests:
+            body = json.dumps(data).encode('utf-8')
+            if len(body) >= cls.compress_min_size:
+                headers = {
+                    'Content-Type': 'application/json',
+                    'Content-Encoding': 'gzip',
+                }
+                return {'data': gzip.compress(body), 'headers': headers}
+        return {'json': data}
+
+    @classmethod
+    def _cache_get(cls, kind, api_token, item_id):
+        if cls.cache is not None:
+            return cls.cache.get(cache_key(kind, api_token, item_id))
+
+    @classmethod
+    def _cache_set(cls, kind, api_token, item_id, value):
+        if cls.cache is not None:
+            cls.cache.set(cache_key(kind, api_token, item_id), value)
+
+    @classmethod
+    def _cache_delete(cls, api_token, project_id, kinds=('files',)):
+        if cls.cache is not None:
+            cls.cache.delete(*[cache_key(kind, api_token, project_id) for kind in kinds])
+
+    @classmethod
+    def _build_project(cls, node, project_cls):
+        kwargs = cls._prepare_project_kwargs(node)
+        name = kwargs.pop('name')
+        return project_cls(name, **kwargs)
 
     @classmethod
     def _prepare_project_kwargs(cls, node):
@@ -57,9 +192,9 @@ class Base:
             'uuid': node.pop('id'),
             # NOTE: bln sdk appears to only return updatedAt on create
             'created_at': node.get('createdAt', node.get('updatedAt')),
-            'updated_at': node.pop('updatedAt'),
-            'contact_method':node.pop('contactMethod'),
-            'is_open': node.pop('isOpen'),
+            'updated_at': node.pop('updatedAt', None),
+            'contact_method': node.pop('contactMethod', None),
+            'is_open': node.pop('isOpen', None),
             'api_token': cls.api_token
         })
         return node
@@ -70,52 +205,276 @@ class BlnClientWrapper(BlnClient):
     """
 
     auth_method = 'JWT'
+    # Files uploaded at once, and extra attempts per failed file
+    concurrency = 4
+    retries = 2
+    # Bytes read from disk at a time; a multiple of 256KB, as resumable
+    # upload sessions require
+    chunk_size = 8 * 1024 * 1024
+    # Upload in resumable sessions (GCS-style) instead of a single PUT
+    resumable = False
+
+    _upload_session = None
+    _upload_lock = threading.Lock()
+
+    def __init__(self, token, tier=None, actor='user'):
+        super().__init__(token, tier=tier or 'prod', actor=actor)
+        if tier is None:
+            # Follow Base.endpoint, so pointing the API elsewhere covers uploads too
+            self.endpoint = Base.endpoint
+
+    def upload_files(self, projectId, files, concurrency=None, retries=None,
+                     progress=None, resumable=None):
+        """Upload files on a thread pool.
+
+        Overrides the SDK's upload_files b/c multiprocessing on Linux
+        is buggy. Each file gets a fresh upload URI and is retried on
+        failure; failures are reported per file instead of raised.
+
+        Files are streamed from disk "chunk_size" bytes at a time. With
+        "resumable", each file is sent in chunks through a resumable
+        session, and an interrupted transfer picks up from the last byte
+        the server kept rather than starting over. Upload URIs that only
+        take a PUT (uriType 'PUT'), or that refuse to start a session,
+        get a single streamed PUT instead.
+
+        "progress" is called as progress(name, bytes_sent, total) while
+        files upload. It is called from worker threads.
+
+        Returns:
+            list: An UploadResult for each file, in order.
+        """
+        files = list(files)
+        retries = self.retries if retries is None else retries
+        resumable = self.resumable if resumable is None else resumable
+        workers = max(1, min(concurrency or self.concurrency, len(files)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bln-upload') as executor:
+            return list(executor.map(
+                lambda path: self._upload(projectId, path, retries, progress, resumable),
+                files
+            ))
+
+    def _upload(self, project_id, path, retries, progress=None, resumable=False):
+        path = os.path.expanduser(str(path))
+        name = os.path.basename(path)
+        if not os.path.isfile(path):
+            return UploadResult(path, name, False, 0, f"invalid path: {path}")
+        for attempt in range(retries + 1):
+            try:
+                uri, uri_type = self._upload_uri(project_id, name)
+                # A URI signed for PUT won't take the POST that starts a session
+                if resumable and uri_type != 'PUT':
+                    self._put_resumable(path, uri, retries, progress)
+                else:
+                    self._put(path, uri, progress)
+                return UploadResult(path, name, True, attempt + 1, None)
+            except (ApiError, requests.RequestException, OSError) as e:
+                # OSError covers files that can't be read, e.g. permissions
+                error = str(e)
+            if attempt < retries:
+                time.sleep(Base.backoff_factor * 2 ** attempt)
+        return UploadResult(path, name, False, retries + 1, error)
+
+    def _upload_uri(self, project_id, name):
+        data = {
+            'operationName': 'CreateFileUploadURI',
+            'query': CREATE_FILE_UPLOAD_URI_QUERY,
+            'variables': {
+                'input': {
+                    'projectId': project_id,
+                    'fileName': name,
+                }
+            }
+        }
+        response = Base.post(self.token, data, endpoint=self.endpoint, auth_method=self.auth_method)
+        if response.get('errors'):
+            raise ApiError(response['errors'])
+        result = response['data']['createFileUploadUri']
+        if result['err']:
+            raise ApiError(result['err'])
+        return result['ok']['uri'], result['ok'].get('uriType')
+
+    def _put(self, path, uri, progress=None):
+        name = os.path.basename(path)
+        headers = {'Content-Type': 'application/octet-stream'}
+        with open(path, 'rb') as f:
+            total = os.fstat(f.fileno()).st_size
+            # requests falls back to chunked encoding for empty file objects
+            data = _ProgressReader(f, name, total, self.chunk_size, progress) if total else b''
+            resp = self.session().put(uri, data=data, headers=headers, timeout=Base.timeout)
+        resp.raise_for_status()
+        if progress and not total:
+            progress(name, 0, 0)
+
+    def _put_resumable(self, path, uri, retries, progress=None):
+        """Upload a file in chunks through a resumable upload session.
+
+        After a dropped connection or a transient error, the server is
+        asked which bytes it kept and the upload resumes from there. Up to
+        "retries" failures in a row are tolerated.
+
+        Falls back to a single PUT if the target won't start a session.
+        """
+        name = os.path.basename(path)
+        session = self.session()
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'x-goog-resumable': 'start',
+        }
+        resp = session.post(uri, headers=headers, timeout=Base.timeout)
+        if resp.status_code in RETRY_STATUSES:
+            resp.raise_for_status()
+        session_uri = resp.headers.get('Location') if resp.ok else None
+        if session_uri is None:
+            # e.g. a 403 or 405 for a URI that only takes a PUT
+            return self._put(path, uri, progress)
+        offset = 0
+        # Failures since the server last acknowledged new bytes
+        failures = 0
+        check_status = False
+        with open(path, 'rb') as f:
+            total = os.fstat(f.fileno()).st_size
+            while True:
+                start = offset
+                try:
+                    if check_status:
+                        # Find out how much arrived before the failure
+                        headers = {'Content-Range': f'bytes */{total}'}
+                        resp = session.put(session_uri, headers=headers, timeout=Base.timeout)
+                    else:
+                        f.seek(offset)
+                        chunk = f.read(self.chunk_size)
+                        headers = {'Content-Range': _content_range(offset, len(chunk), total)}
+                        resp = session.put(session_uri, data=chunk, headers=headers, timeout=Base.timeout)
+                    if resp.status_code in RETRY_STATUSES:
+                        raise requests.HTTPError(f"{resp.status_code} response", response=resp)
+                    if resp.status_code == 308:
+                        offset = _committed_bytes(resp)
+                    else:
+                        resp.raise_for_status()
+                        offset = total
+                except requests.RequestException as e:
+                    transient = not isinstance(e, requests.HTTPError) \
+                        or e.response.status_code in RETRY_STATUSES
+                    if not transient or failures >= retries:
+                        raise
+                    time.sleep(Base.backoff_factor * 2 ** failures)
+                    failures += 1
+                    check_status = True
+                    continue
+                if progress:
+                    progress(name, offset, total)
+                if resp.status_code != 308:
+                    return
+                if offset > start:
+                    failures = 0
+                elif not check_status:
+                    # A chunk was accepted without the session moving forward
+                    if failures >= retries:
+                        raise ApiError(f"Upload session for {name} stalled at byte {offset}")
+                    failures += 1
+                check_status = False
 
-    def upload_files(self, projectId, files):
-        """Override upload_files b/c multiprocessing on Linux is buggy"""
-        for f in files:
-            _upload_file(self.endpoint, self.auth_method, self.token, projectId, f)
+    @classmethod
+    def session(cls):
+        """Session for storage uploads, kept apart so API tokens aren't sent along."""
+        with cls._upload_lock:
+            if BlnClientWrapper._upload_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=cls.concurrency,
+                    pool_maxsize=max(cls.concurrency, Base.pool_size)
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                BlnClientWrapper._upload_session = session
+            return BlnClientWrapper._upload_session
+
+
+class _ProgressReader:
+    """File wrapper that reads at most "chunk_size" bytes at a time and
+    reports the running total to a progress callback.
+    """
+
+    def __init__(self, f, name, total, chunk_size, progress=None):
+        self.f = f
+        self.name = name
+        self.total = total
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.sent = 0
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        chunk = self.read(self.chunk_size)
+        while chunk:
+            yield chunk
+            chunk = self.read(self.chunk_size)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.chunk_size:
+            size = self.chunk_size
+        chunk = self.f.read(size)
+        if chunk:
+            self.sent += len(chunk)
+            if self.progress:
+                self.progress(self.name, self.sent, self.total)
+        return chunk
 
 
 class Client(Base):
 
+    # Projects requested per page by the iter_* listings
+    page_size = 100
+
     def __init__(self, api_token=None):
         self.set_api_token(api_token)
 
     @property
     def user_projects(self):
-        data = {
-            'query': USER_PROJECTS_QUERY,
-            'variables': {}
-        }
-        response = self.post(self.api_token, data)
-        try:
-            raise ApiError(response['errors'])
-        except KeyError:
-            projects = []
-            for edge in response['data']['user']['effectiveProjectRoles']['edges']:
-                node = edge['node']
-                kwargs = self._prepare_project_kwargs(node['project'])
-                kwargs['user_role'] = node['role']
-                name = kwargs.pop('name')
-                project = Project(name, **kwargs)
-                projects.append(project)
-            return projects
+        return list(self.iter_user_projects())
 
     @property
     def open_projects(self):
-        data = {
-            'query': OPEN_PROJECTS_QUERY,
-            'variables': {}
-        }
-        response = self.post(self.api_token, data)
-        projects = []
-        for node in response['data']['openProjects']['edges']:
-            kwargs = self._prepare_project_kwargs(node['node'])
-            name = kwargs.pop('name')
-            project = Project(name, **kwargs)
-            projects.append(project)
-        return projects
+        return list(self.iter_open_projects())
+
+    def iter_user_projects(self, page_size=None, prefetch=False):
+        """Yield the user's projects a page at a time.
+
+        Set "prefetch" to request the next page in the background
+        while the current one is being consumed.
+        """
+        query = USER_PROJECTS_QUERY
+        pages = self._iter_pages(query, _user_projects_page, page_size, prefetch)
+        for node in pages:
+            yield self._build_project(node, Project)
+
+    def iter_open_projects(self, page_size=None, prefetch=False):
+        query = OPEN_PROJECTS_QUERY
+        pages = self._iter_pages(query, _open_projects_page, page_size, prefetch)
+        for node in pages:
+            yield self._build_project(node, Project)
+
+    def _iter_pages(self, query, parse, page_size, prefetch):
+        def fetch(after):
+            data = _page_request(query, page_size or self.page_size, after)
+            return parse(self.post(self.api_token, data))
+
+        if not prefetch:
+            after = None
+            while True:
+                nodes, after = fetch(after)
+                yield from nodes
+                if after is None:
+                    return
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fetch, None)
+            while future:
+                nodes, after = future.result()
+                future = executor.submit(fetch, after) if after is not None else None
+                yield from nodes
 
 
 class File(Base):
@@ -132,43 +491,37 @@ class File(Base):
         return self.__str__()
 
     def delete(self):
-        variables = {
-            "input":{
-                "fileName": self.name,
-                "projectId":self.project_id,
-            }
-        }
-        data = {
-            "operationName":"DeleteFile",
-            'query': DELETE_FILE_QUERY,
-            'variables': variables
-        }
-        return self.post(self.api_token, data)
+        data = _delete_file_request(self.project_id, self.name)
+        try:
+            return self.post(self.api_token, data)
+        finally:
+            self._cache_delete(self.api_token, self.project_id)
 
 
 class Files(Base):
 
     def __get__(self, obj, owner):
-        resp = self._get_files(obj)
+        if obj is None:
+            return self
+        names = self._cache_get('files', obj.api_token, obj.id)
+        if names is None:
+            names = _file_names(self._get_files(obj))
+            self._cache_set('files', obj.api_token, obj.id, names)
         files = [
-            File(obj.api_token, obj.id, node['name'])
-            for node in resp['data']['node']['files']
+            File(obj.api_token, obj.id, name)
+            for name in names
         ]
         return files
 
     def _get_files(self, obj):
-        data = {
-            'query': PROJECT_FILES_QUERY,
-            'variables': {
-                'id': obj.id
-            }
-        }
-        return self.post(obj.api_token, data)
+        return self.post(obj.api_token, _files_request(obj.id))
 
 
 class Project(Base):
 
     files = Files()
+    # Projects looked up per request by get_many
+    batch_size = 50
 
     def __init__(self, name,
         uuid=None,
@@ -207,18 +560,41 @@ class Project(Base):
         return slug
 
     @classmethod
-    def get(cls, uuid, api_token=None):
+    def get(cls, uuid, api_token=None, fields=None):
+        """Look up a project by id.
+
+        Pass "fields" (e.g. ['description']) to only request those
+        fields. Partial lookups skip the cache.
+        """
         cls.set_api_token(api_token)
-        data = {
-            'query': PROJECT_QUERY,
-            'variables': { "id": uuid }
-        }
-        response = cls.post(cls.api_token, data)
-        project_node = response['data']['node']
+        project_node = None
+        if fields is None:
+            project_node = cls._cache_get('project', cls.api_token, uuid)
+        if project_node is None:
+            response = cls.post(cls.api_token, _project_request(uuid, fields))
+            project_node = _project_node(response)
+            if project_node and fields is None:
+                cls._cache_set('project', cls.api_token, uuid, project_node)
         if project_node:
-            kwargs = cls._prepare_project_kwargs(project_node)
-            name = kwargs.pop('name')
-            return cls(name, **kwargs)
+            return cls._build_project(project_node, cls)
+
+    @classmethod
+    def get_many(cls, uuids, api_token=None, batch_size=None, fields=None):
+        """Look up many projects, "batch_size" per request.
+
+        Returns:
+            list: Projects in the order of uuids, with None for
+                any that weren't found.
+        """
+        cls.set_api_token(api_token)
+        projects = []
+        for batch in _batches(uuids, batch_size or cls.batch_size):
+            response = cls.post(cls.api_token, _project_batch_request(batch, fields))
+            projects.extend(
+                cls._build_project(node, cls) if node else None
+                for node in _batch_nodes(response, len(batch))
+            )
+        return projects
 
     @classmethod
     def create(cls, name, api_token=None, meta={}):
@@ -232,6 +608,157 @@ class Project(Base):
             return cls(name, **kwargs)
         return response
 
-    def upload_files(self, files):
+    def upload_files(self, files, concurrency=None, retries=None,
+                     progress=None, resumable=None):
+        """Upload files to the project, overwriting any of the same name.
+
+        See BlnClientWrapper.upload_files for the options.
+
+        Returns:
+            list: An UploadResult (path, name, ok, attempts, error) per file.
+        """
         client = BlnClientWrapper(self.api_token)
-        client.upload_files(self.id, files)
+        try:
+            return client.upload_files(
+                self.id,
+                files,
+                concurrency=concurrency,
+                retries=retries,
+                progress=progress,
+                resumable=resumable
+            )
+        finally:
+            self._cache_delete(self.api_token, self.id)
+
+    def invalidate(self):
+        """Drop cached lookups and file listings for this project."""
+        self._cache_delete(self.api_token, self.id, kinds=('project', 'files'))
+
+
+def _is_mutation(data):
+    return data['query'].lstrip().startswith('mutation')
+
+
+def _content_range(offset, length, total):
+    if not length:
+        return f'bytes */{total}'
+    return f'bytes {offset}-{offset + length - 1}/{total}'
+
+
+def _committed_bytes(resp):
+    """Bytes a resumable session has kept, from a 308 response's Range."""
+    byte_range = resp.headers.get('Range')
+    if not byte_range:
+        return 0
+    return int(byte_range.rsplit('-', 1)[1]) + 1
+
+
+@functools.lru_cache(maxsize=256)
+def _query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def _persisted(data):
+    """Copy of a request with the query text swapped for its hash."""
+    persisted = {key: value for key, value in data.items() if key != 'query'}
+    persisted['extensions'] = {
+        'persistedQuery': {
+            'version': 1,
+            'sha256Hash': _query_hash(data['query']),
+        }
+    }
+    return persisted
+
+
+def _persisted_query_not_found(response):
+    for error in response.get('errors') or []:
+        if 'PersistedQueryNotFound' in (
+            error.get('message'),
+            (error.get('extensions') or {}).get('code'),
+        ):
+            return True
+    return False
+
+
+# Request builders and response parsers, shared with the async client
+
+def _page_request(query, first, after=None):
+    return {'query': query, 'variables': {'first': first, 'after': after}}
+
+
+def _project_request(uuid, fields=None):
+    return {'query': project_query(fields), 'variables': {'id': uuid}}
+
+
+def _project_batch_request(uuids, fields=None):
+    return {
+        'query': project_batch_query(len(uuids), fields),
+        'variables': {f'id{i}': uuid for i, uuid in enumerate(uuids)}
+    }
+
+
+def _files_request(project_id):
+    return {'query': PROJECT_FILES_QUERY, 'variables': {'id': project_id}}
+
+
+def _delete_file_request(project_id, name):
+    return {
+        'operationName': 'DeleteFile',
+        'query': DELETE_FILE_QUERY,
+        'variables': {
+            'input': {
+                'fileName': name,
+                'projectId': project_id,
+            }
+        }
+    }
+
+
+def _user_projects_page(response):
+    """Project nodes (with the user's role) and next cursor from a page."""
+    if 'errors' in response:
+        raise ApiError(response['errors'])
+    connection = response['data']['user']['effectiveProjectRoles']
+    nodes = []
+    for edge in connection['edges']:
+        node = edge['node']['project']
+        node['user_role'] = edge['node']['role']
+        nodes.append(node)
+    return nodes, _next_cursor(connection)
+
+
+def _open_projects_page(response):
+    if 'errors' in response:
+        raise ApiError(response['errors'])
+    connection = response['data']['openProjects']
+    nodes = [edge['node'] for edge in connection['edges']]
+    return nodes, _next_cursor(connection)
+
+
+def _next_cursor(connection):
+    """Cursor for the next page, or None on the last (or an unpaged) page."""
+    page_info = connection.get('pageInfo') or {}
+    if page_info.get('hasNextPage'):
+        return page_info['endCursor']
+
+
+def _project_node(response):
+    return response['data']['node']
+
+
+def _batch_nodes(response, count):
+    """Nodes from a batch response in alias order, None where missing."""
+    data = response.get('data')
+    if data is None:
+        raise ApiError(response.get('errors'))
+    return [data.get(f'p{i}') for i in range(count)]
+
+
+def _batches(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _file_names(response):
+    return [node['name'] for node in response['data']['node']['files']]
@@ -1,18 +1,31 @@
-project_details_fragment = '''
-id
-name
-description
-contact
-contactMethod
-createdAt
-updatedAt
-isOpen
+from bln_etl.utils import snake_to_camel_case
+
+
+PROJECT_FIELDS = (
+    'id',
+    'name',
+    'description',
+    'contact',
+    'contactMethod',
+    'createdAt',
+    'updatedAt',
+    'isOpen',
+)
+
+project_details_fragment = '\n' + '\n'.join(PROJECT_FIELDS) + '\n'
+
+page_info_fragment = '''
+pageInfo {
+    hasNextPage
+    endCursor
+}
 '''
 
 USER_PROJECTS_QUERY = f'''
-query {{
+query UserProjects($first: Int, $after: String) {{
     user {{
-       effectiveProjectRoles {{
+       effectiveProjectRoles(first: $first, after: $after) {{
+            {page_info_fragment}
             edges {{
                 node {{
                     role
@@ -27,8 +40,9 @@ query {{
 '''
 
 OPEN_PROJECTS_QUERY = f'''
-query {{
-    openProjects {{
+query OpenProjects($first: Int, $after: String) {{
+    openProjects(first: $first, after: $after) {{
+        {page_info_fragment}
         edges {{
             node {{
               {project_details_fragment}
@@ -39,30 +53,77 @@ query {{
 '''
 
 
-PROJECT_QUERY = f'''
+def project_fields(fields=None):
+    """Selection of project fields, or all of them if "fields" is None.
+
+    Fields may be given in snake or camel case. The id and name fields
+    are always selected since Project objects need them.
+    """
+    if fields is None:
+        return project_details_fragment
+    selected = ['id', 'name']
+    for field in fields:
+        field = snake_to_camel_case(field)
+        if field not in selected:
+            selected.append(field)
+    return '\n' + '\n'.join(selected) + '\n'
+
+
+def project_query(fields=None):
+    return f'''
 query Node($id: ID!) {{
     node(id: $id) {{
         ... on Project {{
-              {project_details_fragment}
+              {project_fields(fields)}
         }}
     }}
 }}
 '''
 
 
-PROJECT_FILES_QUERY = f'''
+def project_batch_query(count, fields=None):
+    """Query looking up "count" projects at once.
+
+    Nodes are aliased p0, p1... and take their IDs from the variables
+    id0, id1... so lookups can be packed into a single request.
+    """
+    selection = project_fields(fields)
+    variables = ', '.join(f'$id{i}: ID!' for i in range(count))
+    nodes = '\n'.join(
+        f'''
+    p{i}: node(id: $id{i}) {{
+        ... on Project {{
+              {selection}
+        }}
+    }}'''
+        for i in range(count)
+    )
+    return f'''
+query Nodes({variables}) {{{nodes}
+}}
+'''
+
+
+def project_files_query(fields=('name',)):
+    """Query listing a project's files, selecting only "fields" of each."""
+    selection = '\n'.join(snake_to_camel_case(field) for field in fields)
+    return f'''
 query Node($id: ID!) {{
     node(id: $id) {{
         ... on Project {{
-            {project_details_fragment}
             files {{
-              name
+              {selection}
             }}
         }}
     }}
 }}
 '''
 
+
+PROJECT_QUERY = project_query()
+
+PROJECT_FILES_QUERY = project_files_query()
+
 DELETE_FILE_QUERY = '''
 mutation DeleteFile($input: FileURIInput!) {
     deleteFile(input: $input) {
@@ -72,3 +133,16 @@ mutation DeleteFile($input: FileURIInput!) {
     }
 }
 '''
+
+CREATE_FILE_UPLOAD_URI_QUERY = '''
+mutation CreateFileUploadURI($input: FileURIInput!) {
+    createFileUploadUri(input: $input) {
+      ok {
+        name
+        uri
+        uriType
+      }
+      err
+    }
+}
+'''
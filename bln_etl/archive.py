@@ -1,8 +1,20 @@
 import os
+import binascii
+import fnmatch
 import glob
-
+import hashlib
+import json
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile, TemporaryFile
+from types import MappingProxyType
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED, ZIP_LZMA
+
+from . import _zipcompat
 
 
 try:
@@ -11,13 +23,112 @@ try:
 except ImportError:
     COMPRESSION_TYPE=ZIP_STORED
 
+# Read/write files in 1MB chunks
+CHUNK_SIZE = 1024 * 1024
+# Compressed members larger than this are spooled to disk by workers
+SPOOL_SIZE = 16 * 1024 * 1024
+
+# Rough upper bounds on zip bookkeeping, used to size volumes
+MEMBER_OVERHEAD = 200
+END_RECORD_SIZE = 100
+
+# Name of the checksum manifest when stored inside an archive
+MANIFEST_NAME = 'manifest.json'
+# Upper bound on a manifest entry's JSON, not counting the member name
+MANIFEST_ENTRY_SIZE = 140
+
+# Formats that are already compressed and don't shrink any further
+STORED_EXTENSIONS = frozenset([
+    '.7z', '.avif', '.br', '.bz2', '.docx', '.gif', '.gz', '.jpeg', '.jpg',
+    '.mp3', '.mp4', '.parquet', '.pdf', '.png', '.pptx', '.tgz', '.webp',
+    '.xlsx', '.xz', '.zip', '.zst',
+])
+
+
+class CompressionPolicy:
+    """Pick a compression type and level for each archive member.
+
+    Files with an already-compressed extension are stored as-is.
+    Use "sample_size" to also store any other file whose first
+    bytes shrink by less than "min_ratio" when compressed.
+
+    Policies are callables, so any function that takes a path and
+    returns a (compress_type, compresslevel) tuple works as well.
+    Members added from in-memory data are passed their archive name,
+    and are never sampled by CompressionPolicy.
+
+    USAGE:
+        # Favor throughput...
+        policy = CompressionPolicy(compresslevel=1)
+        # ...or size
+        policy = CompressionPolicy(compress_type=ZIP_LZMA)
+        archive.add_dir('/tmp/folder-with-data', compression=policy)
+    """
+
+    def __init__(self, compress_type=COMPRESSION_TYPE, compresslevel=None,
+                 store_extensions=STORED_EXTENSIONS, sample_size=None, min_ratio=0.9):
+        self.compress_type = compress_type
+        self.compresslevel = compresslevel
+        self.store_extensions = store_extensions
+        self.sample_size = sample_size
+        self.min_ratio = min_ratio
+
+    def __call__(self, path, sample=True):
+        stored = (ZIP_STORED, None)
+        if Path(path).suffix.lower() in self.store_extensions:
+            return stored
+        if sample and self.sample_size and COMPRESSION_TYPE == ZIP_DEFLATED:
+            with open(path, 'rb') as src:
+                sample = src.read(self.sample_size)
+            if sample and len(zlib.compress(sample, 1)) > len(sample) * self.min_ratio:
+                return stored
+        return (self.compress_type, self.compresslevel)
+
+
+# Presets that trade size for speed, or the other way around
+FAST = CompressionPolicy(compresslevel=1)
+SMALL = CompressionPolicy(compress_type=ZIP_LZMA)
+
 
 class Archive:
+    """Wrapper around a zip file on disk.
 
-    def __init__(self, path):
+    Use "compression" to set a default CompressionPolicy for members.
+
+    Use "manifest" to record the SHA-256 and size of every member as
+    it is written, either in a "sidecar" JSON file next to the zip
+    (e.g. data.manifest.json for data.zip) or as a "member" of the
+    zip itself (manifest.json). Checksums are computed in the same
+    read pass used for compression.
+
+    Files can't be added under the name of a member manifest. Use
+    "manifest_name" to store the manifest under another name if the
+    data has a manifest.json of its own.
+    """
+
+    def __init__(self, path, compression=None, manifest=None, manifest_name=MANIFEST_NAME):
+        if manifest not in (None, 'sidecar', 'member'):
+            raise ValueError("manifest must be None, 'sidecar' or 'member'")
         self.path = Path(path)
+        self.compression = compression
+        self.manifest = manifest
+        self.manifest_name = manifest_name
+        self._members = None
+        self._index = None
+        self._members_key = None
+        self._reader = None
+
+    def writer(self, mode='a', compression=None):
+        """Open the zip once for a batch of writes.
 
-    def add(self, path, mode='a', rename=None, drop_root=None):
+        USAGE:
+            with archive.writer() as writer:
+                writer.add('/tmp/data.csv', rename='foo.csv')
+                writer.add_dir('/tmp/folder-with-data')
+        """
+        return ArchiveWriter(self, mode=mode, compression=compression)
+
+    def add(self, path, mode='a', rename=None, drop_root=None, compression=None):
         """Add file to archive.
 
         By default, this method:
@@ -31,25 +142,116 @@ class Archive:
 
         Use "drop_root" to preserve nested directory structure starting after
         a specified path component (non-inclusive of specified path).
+
+        Use "compression" to pass a CompressionPolicy (or any callable
+        returning a compress type and level) instead of the archive default.
         """
-        with ZipFile(self.path, mode) as zfile:
-            args = [path]
-            kwargs = {
-                'compress_type': COMPRESSION_TYPE,
-            }
-            if drop_root:
-                kwargs['arcname'] = self._arcname(path, drop_root)
-            else:
-                kwargs['arcname'] = Path(path).name
-            if rename:
-                kwargs['arcname'] = self._rename(kwargs['arcname'], rename)
-            zfile.write(path, **kwargs)
+        with self.writer(mode, compression) as writer:
+            writer.add(path, rename=rename, drop_root=drop_root)
+
+    def add_many(self, paths, mode='a', compression=None):
+        """Add many files to archive in a single open/close of the zip.
+
+        Each item is either a file path or a dict of keyword
+        arguments for "add" (e.g. {'path': ..., 'rename': ...}).
+        """
+        with self.writer(mode, compression) as writer:
+            for item in paths:
+                if isinstance(item, dict):
+                    writer.add(**item)
+                else:
+                    writer.add(item)
+
+    def add_data(self, arcname, data, mode='a', compression=None, force_zip64=False):
+        """Add a member from in-memory data rather than a file on disk.
+
+        "data" can be bytes or str, a binary file-like object, or an
+        iterable of bytes/str chunks (e.g. rows encoded as they are
+        produced). Chunks are streamed straight into the compressor,
+        so memory use stays flat for large generated outputs.
+
+        Pass "force_zip64" when streaming more than 2GB of data of
+        unknown length.
+        """
+        with self.writer(mode, compression) as writer:
+            writer.add_data(arcname, data, force_zip64=force_zip64)
 
     def list(self):
-        with ZipFile(self.path, 'r') as zfile:
-            return zfile.namelist()
+        return [info.filename for info in self._infolist()]
+
+    @property
+    def manifest_path(self):
+        return self.path.with_suffix('.manifest.json')
+
+    def read_manifest(self):
+        """Checksums recorded for the archive's members.
+
+        Returns:
+            dict: Mapping of member name to its "sha256" and "size".
+            Empty if no manifest has been written.
+        """
+        if self.manifest == 'sidecar':
+            if not self.manifest_path.exists():
+                return {}
+            return json.loads(self.manifest_path.read_text())
+        if not self.path.exists() or self.manifest_name not in self.index:
+            return {}
+        with self.open(self.manifest_name) as fh:
+            return json.loads(fh.read().decode('utf-8'))
+
+    @property
+    def index(self):
+        """Members of the archive keyed by name.
+
+        The central directory is parsed once and cached until the
+        zip file changes on disk. Values are ZipInfo objects, which
+        carry each member's size, CRC and header offset.
+        """
+        self._infolist()
+        return self._index
 
-    def add_dir(self, folder, mode='a', pattern='**/*', skip_hidden=True):
+    def open(self, member):
+        """Open a member for reading as a binary file-like object.
+
+        The zip is kept open alongside the cached index, so members
+        are read without re-parsing its central directory. Use close()
+        to release the zip once done.
+
+        USAGE:
+            with archive.open('data.csv') as fh:
+                header = fh.readline()
+        """
+        info = self.index[member]
+        return self._reader.open(info)
+
+    def close(self):
+        """Close the zip kept open for reading members.
+
+        Members already opened can still be read.
+        """
+        self._invalidate()
+
+    def _infolist(self):
+        stat = os.stat(self.path)
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if self._members is None or key != self._members_key:
+            self._invalidate()
+            self._reader = ZipFile(self.path, 'r')
+            self._members = self._reader.infolist()
+            # Read-only, since the same mapping is handed to every caller
+            self._index = MappingProxyType(dict(self._reader.NameToInfo))
+            self._members_key = key
+        return self._members
+
+    def _invalidate(self):
+        self._members = None
+        self._index = None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def add_dir(self, folder, mode='a', pattern='**/*', skip_hidden=True,
+                workers=1, incremental=False, compression=None):
         """Append directory contents to a zipfile
 
         Preserves nested structure of files within a directory, 
@@ -58,37 +260,717 @@ class Archive:
 
         Skips hidden files and folders by default.
 
+        Use "workers" to compress files in parallel on a thread pool.
+        Compressed members are still written to the zip in the same
+        order as the serial version.
+
+        Use "incremental" to only write files that are new or have
+        changed since they were last archived (compared by size, mtime
+        and CRC). Changed files replace their previous copy rather than
+        being appended as duplicates.
+
+        Use "compression" to pick a compression type and level per file.
+        See Archive.add.
+
+        Returns:
+            dict: Counts of "added", "skipped" and "replaced" files.
+
         """
         root = Path(folder)
-        with ZipFile(self.path, mode=mode) as zfile:
-            for pth in root.glob(pattern):
-                if pth.is_dir():
-                    continue
-                if skip_hidden and pth.name.startswith('.'):
-                    continue
-                arcname = self._arcname(pth, root)
-                zfile.write(
-                    pth,
-                    arcname=arcname,
-                    compress_type=COMPRESSION_TYPE
+        members = _dir_members(root, pattern, skip_hidden)
+        if incremental and mode == 'a' and self.path.exists():
+            return self._add_incremental(members, workers, compression)
+        with self.writer(mode, compression) as writer:
+            added = writer.add_members(members, workers=workers)
+        return {'added': added, 'skipped': 0, 'replaced': 0}
+
+    def add_tree(self, repo, treeish='HEAD', paths=None, pattern=None,
+                 drop_root=None, mode='a', compression=None):
+        """Add files from a commit or tree in a git Repository.
+
+        Blobs are streamed out of git's object store, so no working
+        tree (or checkout) is needed, and bare repositories work too.
+        Members are dated with the commit's timestamp.
+
+        Args:
+            repo (Repository): Repository to read from.
+            treeish (str): Commit, branch, tag or tree to archive.
+            paths (list): Only include files under these paths.
+            pattern (str): Only include files whose path matches this glob.
+            drop_root (str): Drop leading path components up to and
+                including this one, as with Archive.add.
+
+        Returns:
+            int: Number of files added.
+        """
+        with self.writer(mode, compression) as writer:
+            return writer.add_tree(
+                repo,
+                treeish=treeish,
+                paths=paths,
+                pattern=pattern,
+                drop_root=drop_root
+            )
+
+    def add_dir_volumes(self, folder, max_size, pattern='**/*', skip_hidden=True, workers=1):
+        """Split directory contents across several self-contained zips.
+
+        Volumes are named after the archive, e.g. data.001.zip,
+        data.002.zip for data.zip, and each one can be read on its own.
+        Files are compressed first, then packed by compressed size,
+        largest first into the emptiest volume with room, so volumes end
+        up about the same size. Any file that compression would grow is
+        stored as is. Each volume stays under "max_size" bytes, unless a
+        single member is bigger than that, in which case it gets a
+        volume of its own.
+
+        Volumes are (re)written from scratch, and stale volumes left
+        over from a previous, larger split are removed. Use "workers"
+        to compress files in parallel.
+
+        Returns:
+            list: An Archive for each volume, in order.
+        """
+        members = _dir_members(Path(folder), pattern, skip_hidden)
+        manifest = self.manifest == 'member'
+        checksum = self.manifest is not None
+        manifest_name = self.manifest_name if manifest else None
+        # Compressed members wait in a single scratch file, rather than
+        # one spool each, until we know which volume they go in
+        with TemporaryFile(dir=self.path.parent) as scratch:
+            compressed = []
+            for zinfo, data, digest in _compress_members(
+                members, self.compression, checksum, workers, store_if_larger=True
+            ):
+                offset = scratch.tell()
+                shutil.copyfileobj(data, scratch, CHUNK_SIZE)
+                data.close()
+                compressed.append((zinfo, offset, digest))
+            sizes = [_member_size(zinfo, manifest) for zinfo, _, _ in compressed]
+            volumes = _pack_volumes(sizes, max_size, manifest_name)
+            archives = [
+                Archive(
+                    self._volume_path(number),
+                    compression=self.compression,
+                    manifest=self.manifest,
+                    manifest_name=self.manifest_name
                 )
+                for number in range(1, len(volumes) + 1)
+            ]
+            current = [archive.path for archive in archives]
+            for pth in self._volume_paths():
+                if pth not in current:
+                    pth.unlink()
+            for archive, volume in zip(archives, volumes):
+                with archive.writer('w') as writer:
+                    for i in volume:
+                        zinfo, offset, digest = compressed[i]
+                        scratch.seek(offset)
+                        writer._write_compressed(zinfo, scratch, digest)
+        return archives
 
-    def extractall(self, path=None):
+    def _volume_path(self, number):
+        return self.path.with_name(f"{self.path.stem}.{number:03d}{self.path.suffix}")
+
+    def _volume_paths(self):
+        pattern = f"{glob.escape(self.path.stem)}.[0-9][0-9][0-9]{self.path.suffix}"
+        return sorted(self.path.parent.glob(pattern))
+
+    def extractall(self, path=None, members=None, workers=1, skip_existing=False):
         """Extract zip contents to same dir as zip.
 
         Args:
             path (str): Specify an alternate directory to extract members to.
+            members (str, list or callable): Only extract members whose names
+                match a glob pattern (or any of a list of patterns), or for
+                which a callable returns True.
+            workers (int): Decompress members in parallel on a thread pool.
+                Each worker reads through its own handle to the zip.
+            skip_existing (bool): Skip members already on disk with a
+                matching size and CRC.
+
+        Returns:
+            list: Names of the extracted members.
 
         """
         extract_to = path or Path(self.path).parent
         with ZipFile(self.path, mode='r') as zfile:
-            zfile.extractall(path=extract_to)
+            infos = [
+                info for info in zfile.infolist()
+                if _selected(info.filename, members)
+            ]
+        if skip_existing:
+            infos = [
+                info for info in infos
+                if not _extracted(info, Path(extract_to, info.filename))
+            ]
+        if workers > 1:
+            self._extract_parallel(infos, extract_to, workers)
+        else:
+            with ZipFile(self.path, mode='r') as zfile:
+                for info in infos:
+                    zfile.extract(info, path=extract_to)
+        return [info.filename for info in infos]
+
+    def _extract_parallel(self, infos, extract_to, workers):
+        local = threading.local()
+        handles = []
+
+        def extract(info):
+            if not hasattr(local, 'zfile'):
+                local.zfile = ZipFile(self.path, mode='r')
+                handles.append(local.zfile)
+            try:
+                local.zfile.extract(info, path=extract_to)
+            except FileExistsError:
+                # ZipFile.extract checks for a directory before creating
+                # it, so workers sharing a new directory can race. It
+                # exists now, so a second try goes through.
+                local.zfile.extract(info, path=extract_to)
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Consume results so worker errors are raised here
+                list(executor.map(extract, infos))
+        finally:
+            for zfile in handles:
+                zfile.close()
+
+    def _add_incremental(self, members, workers, compression):
+        existing = self.index
+        to_write = []
+        replaced = set()
+        skipped = 0
+        for pth, arcname in members:
+            info = existing.get(arcname)
+            if info is None:
+                to_write.append((pth, arcname))
+            elif _unchanged(info, pth):
+                skipped += 1
+            else:
+                to_write.append((pth, arcname))
+                replaced.add(arcname)
+        if replaced:
+            self._drop_members(replaced)
+        with self.writer('a', compression) as writer:
+            writer.add_members(to_write, workers=workers)
+        return {
+            'added': len(to_write) - len(replaced),
+            'skipped': skipped,
+            'replaced': len(replaced),
+        }
+
+    def _drop_members(self, names):
+        # Zips can't delete members in place, so copy everything else
+        # (still compressed) into a new file and swap it in. Superseded
+        # duplicates of a name are dropped along the way.
+        tmp = NamedTemporaryFile(dir=self.path.parent, suffix='.zip', delete=False)
+        tmp.close()
+        try:
+            with ZipFile(self.path, 'r') as src, ZipFile(tmp.name, 'w') as dest:
+                for info in src.infolist():
+                    if info.filename in names:
+                        continue
+                    if src.NameToInfo[info.filename] is not info:
+                        continue
+                    _zipcompat.copy_member(src, info, dest, CHUNK_SIZE)
+            # Let go of the zip before swapping it out
+            self._invalidate()
+            os.replace(tmp.name, self.path)
+        finally:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+
+
+class ArchiveWriter:
+    """Context manager that keeps an Archive's zip open across writes.
+
+    Opening a zip in append mode re-reads its central directory,
+    so batching writes avoids paying that cost once per file.
+    """
+
+    def __init__(self, archive, mode='a', compression=None):
+        self.archive = archive
+        self.mode = mode
+        self.compression = compression or archive.compression
+        self.zfile = None
+        self.checksums = {} if archive.manifest else None
+        self._previous_checksums = {}
+
+    def __enter__(self):
+        # Release the archive's read handle, since the zip is about to change
+        self.archive._invalidate()
+        self.zfile = ZipFile(self.archive.path, mode=self.mode)
+        if self.checksums is not None and self.mode == 'a':
+            self._previous_checksums = self._pop_manifest()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            # Members written before an error stay in the zip, and in
+            # member mode the old manifest was already taken out, so the
+            # manifest is written on the error path too
+            if self.checksums is not None:
+                self._write_manifest()
+        finally:
+            self.zfile.close()
+            self.zfile = None
+            self.archive._invalidate()
+
+    def add(self, path, rename=None, drop_root=None):
+        """Add a file. See Archive.add for options."""
+        self._write_file(path, _member_name(path, rename, drop_root))
+
+    def add_data(self, arcname, data, force_zip64=False):
+        """Add a member from in-memory data. See Archive.add_data."""
+        zinfo = _data_info(arcname, data, self.compression)
+        self._write_chunks(zinfo, _iter_data(data, CHUNK_SIZE), force_zip64)
+
+    def add_tree(self, repo, treeish='HEAD', paths=None, pattern=None, drop_root=None):
+        """Add files from a git tree. See Archive.add_tree for options."""
+        date_time = time.localtime(repo.commit_time(treeish))[:6]
+        count = 0
+        for path, mode, size, chunks in repo.iter_blobs(treeish, paths):
+            if pattern and not fnmatch.fnmatch(path, pattern):
+                continue
+            arcname = _arcname(path, drop_root) if drop_root else path
+            zinfo = ZipInfo(arcname, date_time=date_time)
+            _zipcompat.set_compression(
+                zinfo, *_compression_for(self.compression, path, on_disk=False)
+            )
+            zinfo.external_attr = mode << 16
+            zinfo.file_size = size
+            self._write_chunks(zinfo, chunks)
+            count += 1
+        return count
+
+    def add_dir(self, folder, pattern='**/*', skip_hidden=True, workers=1):
+        """Add directory contents. See Archive.add_dir for options."""
+        root = Path(folder)
+        members = _dir_members(root, pattern, skip_hidden)
+        return self.add_members(members, workers=workers)
+
+    def add_members(self, members, workers=1):
+        """Add (path, arcname) pairs. Returns the number of files written."""
+        if workers > 1:
+            return self._write_parallel(members, workers)
+        count = 0
+        for pth, arcname in members:
+            self._write_file(pth, arcname)
+            count += 1
+        return count
+
+    def _write_file(self, path, arcname):
+        if os.path.isdir(path):
+            # Directory entries have no data, so ZipFile.write does it all
+            self.zfile.write(path, arcname)
+            return
+        # Same as ZipFile.write, but lets us hash while compressing
+        zinfo = ZipInfo.from_file(path, arcname)
+        _zipcompat.set_compression(zinfo, *_compression_for(self.compression, path))
+        self._write_chunks(zinfo, _iter_file(path, CHUNK_SIZE))
+
+    def _write_chunks(self, zinfo, chunks, force_zip64=False):
+        self._check_name(zinfo.filename)
+        digest = self._digest()
+        with self.zfile.open(zinfo, 'w', force_zip64=force_zip64) as dest:
+            for chunk in chunks:
+                dest.write(chunk)
+                if digest:
+                    digest.update(chunk)
+        self._record(zinfo, digest)
+
+    def _write_parallel(self, members, workers):
+        checksum = self.checksums is not None
+        count = 0
+        for zinfo, data, digest in _compress_members(
+            members, self.compression, checksum, workers
+        ):
+            with data:
+                self._write_compressed(zinfo, data, digest)
+            count += 1
+        return count
+
+    def _write_compressed(self, zinfo, data, digest):
+        self._check_name(zinfo.filename)
+        _zipcompat.write_compressed(self.zfile, zinfo, data, CHUNK_SIZE)
+        self._record(zinfo, digest)
+
+    def _check_name(self, arcname):
+        if self.archive.manifest == 'member' and arcname == self.archive.manifest_name:
+            raise ValueError(
+                f"{arcname} is reserved for the archive's checksum manifest. "
+                "Pass a different manifest_name to Archive."
+            )
+
+    def _digest(self):
+        if self.checksums is not None:
+            return hashlib.sha256()
+
+    def _record(self, zinfo, digest):
+        if digest:
+            self.checksums[zinfo.filename] = {
+                'sha256': digest.hexdigest(),
+                'size': zinfo.file_size,
+            }
+
+    def _pop_manifest(self):
+        """Load the current manifest, removing it from the zip if stored there."""
+        if self.archive.manifest == 'sidecar':
+            return self.archive.read_manifest()
+        info = self.zfile.NameToInfo.get(self.archive.manifest_name)
+        if info is None:
+            return {}
+        checksums = json.loads(self.zfile.read(info).decode('utf-8'))
+        # The manifest is always written last, so its space is normally
+        # reclaimed by writing over it
+        _zipcompat.remove_member(self.zfile, info)
+        return checksums
+
+    def _write_manifest(self):
+        checksums = dict(self._previous_checksums)
+        checksums.update(self.checksums)
+        content = json.dumps(checksums, indent=2, sort_keys=True)
+        if self.archive.manifest == 'sidecar':
+            self.archive.manifest_path.write_text(content)
+        else:
+            self.zfile.writestr(
+                self.archive.manifest_name,
+                content,
+                compress_type=COMPRESSION_TYPE
+            )
+
+
+class ArchiveStream:
+    """Build a zip on the fly, without a file on disk or any seeking.
+
+    Members are written with data descriptors, so zip bytes can be sent
+    to an upload or other non-seekable sink as they are produced. Memory
+    use is bounded by the chunk size, not by the size of the archive.
+
+    USAGE:
+        stream = ArchiveStream()
+        stream.add('/tmp/data.csv', rename='foo.csv')
+        stream.add_dir('/tmp/folder-with-data')
+
+        # Iterate over chunks of zip bytes...
+        for chunk in stream:
+            upload(chunk)
+
+        # ...or write them to any writable file-like object
+        stream.write_to(sys.stdout.buffer)
+
+    Pass "manifest=True" to append a manifest.json member with the
+    SHA-256 and size of every other member, and "manifest_name" to
+    give it another name.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, compression=None, manifest=False,
+                 manifest_name=MANIFEST_NAME):
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.manifest = manifest
+        self.manifest_name = manifest_name
+        self.members = []
+
+    def add(self, path, rename=None, drop_root=None):
+        """Queue a file. See Archive.add for options."""
+        self._queue(_member_name(path, rename, drop_root), path, False)
+
+    def add_dir(self, folder, pattern='**/*', skip_hidden=True):
+        """Queue directory contents. See Archive.add_dir for options."""
+        for pth, arcname in _dir_members(Path(folder), pattern, skip_hidden):
+            self._queue(arcname, pth, False)
+
+    def add_data(self, arcname, data):
+        """Queue in-memory data. See Archive.add_data for accepted types.
+
+        Iterators are only consumed once the stream is iterated.
+        """
+        self._queue(arcname, data, True)
+
+    def _queue(self, arcname, source, is_data):
+        if self.manifest and arcname == self.manifest_name:
+            raise ValueError(
+                f"{arcname} is reserved for the stream's checksum manifest. "
+                "Pass a different manifest_name to ArchiveStream."
+            )
+        self.members.append((arcname, source, is_data))
+
+    def __iter__(self):
+        sink = _StreamSink()
+        checksums = {}
+        with ZipFile(sink, mode='w') as zfile:
+            for arcname, source, is_data in self.members:
+                if is_data:
+                    zinfo = _data_info(arcname, source, self.compression)
+                    chunks = _iter_data(source, self.chunk_size)
+                else:
+                    zinfo = ZipInfo.from_file(source, arcname)
+                    _zipcompat.set_compression(
+                        zinfo, *_compression_for(self.compression, source)
+                    )
+                    chunks = _iter_file(source, self.chunk_size)
+                digest = hashlib.sha256() if self.manifest else None
+                # Sizes of in-memory data aren't always known up front
+                with zfile.open(zinfo, 'w', force_zip64=is_data) as dest:
+                    for chunk in chunks:
+                        dest.write(chunk)
+                        if digest:
+                            digest.update(chunk)
+                        if sink.size >= self.chunk_size:
+                            yield sink.drain()
+                if digest:
+                    checksums[arcname] = {
+                        'sha256': digest.hexdigest(),
+                        'size': zinfo.file_size,
+                    }
+                # Flush the member's tail and data descriptor
+                if sink.size:
+                    yield sink.drain()
+            if self.manifest:
+                content = json.dumps(checksums, indent=2, sort_keys=True)
+                zfile.writestr(self.manifest_name, content, compress_type=COMPRESSION_TYPE)
+        # Central directory is written on close
+        yield sink.drain()
+
+    def write_to(self, fileobj):
+        """Write the zip to a writable file-like object."""
+        for chunk in self:
+            fileobj.write(chunk)
+
+
+class _StreamSink:
+    """Write-only buffer that ZipFile treats as a non-seekable stream."""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def _pack_volumes(sizes, max_size, manifest_name=None):
+    """Group members into balanced volumes under max_size.
+
+    Takes the size of each member, see _member_size, and returns lists
+    of member indexes. Pass "manifest_name" to leave room for a manifest
+    member in each volume.
+    """
+    base = END_RECORD_SIZE
+    if manifest_name:
+        base += MEMBER_OVERHEAD + 2 * len(manifest_name.encode('utf-8'))
+    # Start with the fewest volumes that could hold everything, then
+    # add more only when a file doesn't fit in any of them.
+    count = max(1, -(-sum(sizes) // max(max_size - base, 1)))
+    volumes = [[] for _ in range(count)]
+    loads = [base] * count
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True)
+    for i in order:
+        fits = [v for v in range(len(volumes)) if loads[v] + sizes[i] <= max_size]
+        if fits:
+            target = min(fits, key=lambda v: loads[v])
+        else:
+            volumes.append([])
+            loads.append(base)
+            target = len(volumes) - 1
+        volumes[target].append(i)
+        loads[target] += sizes[i]
+    # Keep the original member order within each volume
+    return [sorted(volume) for volume in volumes if volume]
+
+
+def _member_size(zinfo, manifest=False):
+    """Upper bound on the bytes a compressed member takes up in a zip."""
+    name_size = len(zinfo.filename.encode('utf-8'))
+    # Each member has a local header, a central directory entry and
+    # possibly Zip64 extras
+    size = zinfo.compress_size + MEMBER_OVERHEAD + 2 * name_size
+    if manifest:
+        # Name, SHA-256 and size in the (uncompressed) manifest JSON
+        size += name_size + MANIFEST_ENTRY_SIZE
+    return size
+
+
+def _dir_members(root, pattern, skip_hidden):
+    for pth in root.glob(pattern):
+        if pth.is_dir():
+            continue
+        if skip_hidden and pth.name.startswith('.'):
+            continue
+        yield pth, _arcname(pth, root)
+
+
+def _member_name(path, rename=None, drop_root=None):
+    if drop_root:
+        arcname = _arcname(path, drop_root)
+    else:
+        arcname = Path(path).name
+    if rename:
+        arcname = _rename(arcname, rename)
+    return arcname
+
+
+def _arcname(file_path, split_on):
+    # Remove root folders and leading slash
+    return str(file_path)\
+            .split(str(split_on))[-1]\
+            .lstrip('/')
+
+
+def _rename(arcname, new_name):
+    return str(Path(arcname).with_name(new_name))
+
+
+def _compression_for(policy, path, on_disk=True):
+    if policy is None:
+        return (COMPRESSION_TYPE, None)
+    if not on_disk and isinstance(policy, CompressionPolicy):
+        return policy(path, sample=False)
+    return policy(path)
+
+
+def _data_info(arcname, data, policy):
+    zinfo = ZipInfo(arcname, date_time=time.localtime()[:6])
+    _zipcompat.set_compression(zinfo, *_compression_for(policy, arcname, on_disk=False))
+    zinfo.external_attr = 0o644 << 16
+    if isinstance(data, (bytes, bytearray)):
+        zinfo.file_size = len(data)
+    return zinfo
+
+
+def _iter_file(path, chunk_size):
+    with open(path, 'rb') as src:
+        for chunk in iter(lambda: src.read(chunk_size), b''):
+            yield chunk
+
+
+def _iter_data(data, chunk_size):
+    """Yield chunks of bytes from bytes, str, file-like objects or iterables.
+
+    Text is encoded as UTF-8.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if isinstance(data, (bytes, bytearray)):
+        chunks = (
+            data[start:start + chunk_size]
+            for start in range(0, len(data), chunk_size)
+        )
+    elif hasattr(data, 'read'):
+        chunks = iter(lambda: data.read(chunk_size), data.read(0))
+    else:
+        chunks = data
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        yield chunk
+
+
+def _compress_members(members, policy, checksum, workers, store_if_larger=False):
+    """Compress (path, arcname) pairs on a thread pool.
+
+    Yields the results of _compress_file in the same order as members.
+    """
+    # zlib releases the GIL while compressing, so threads are enough
+    # to keep several cores busy. Only a bounded window of members is
+    # in flight at once, which keeps memory and temp space in check.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for pth, arcname in members:
+            pending.append(executor.submit(
+                _compress_file, pth, arcname, policy, checksum, store_if_larger
+            ))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _compress_file(path, arcname, policy=None, checksum=False, store_if_larger=False):
+    """Compress a file into a spooled buffer, ready for write_compressed.
+
+    With "store_if_larger", a file that compression grows is stored
+    uncompressed instead.
+
+    Returns the member's ZipInfo, the buffer and, if requested,
+    a SHA-256 digest of the uncompressed contents.
+    """
+    compress_type, compresslevel = _compression_for(policy, path)
+    zinfo = ZipInfo.from_file(path, arcname)
+    _zipcompat.set_compression(zinfo, compress_type, compresslevel)
+    compressor = _zipcompat.get_compressor(compress_type, compresslevel)
+    spool = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    digest = hashlib.sha256() if checksum else None
+    crc = 0
+    size = 0
+    with open(path, 'rb') as src:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            size += len(chunk)
+            crc = binascii.crc32(chunk, crc)
+            if digest:
+                digest.update(chunk)
+            if compressor:
+                chunk = compressor.compress(chunk)
+            spool.write(chunk)
+    if compressor:
+        spool.write(compressor.flush())
+    if compressor and store_if_larger and spool.tell() > size:
+        spool.close()
+        spool = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        with open(path, 'rb') as src:
+            shutil.copyfileobj(src, spool, CHUNK_SIZE)
+        _zipcompat.set_compression(zinfo, ZIP_STORED, None)
+    zinfo.file_size = size
+    zinfo.compress_size = spool.tell()
+    zinfo.CRC = crc
+    spool.seek(0)
+    return zinfo, spool, digest
+
+
+def _selected(name, members):
+    if members is None:
+        return True
+    if callable(members):
+        return members(name)
+    if isinstance(members, str):
+        members = [members]
+    return any(fnmatch.fnmatch(name, pattern) for pattern in members)
+
+
+def _extracted(zinfo, path):
+    """Check whether a member was already extracted to path."""
+    if zinfo.is_dir() or not path.is_file():
+        return False
+    if zinfo.file_size != path.stat().st_size:
+        return False
+    return zinfo.CRC == _file_crc(path)
+
+
+def _unchanged(zinfo, path):
+    """Check whether a file on disk matches an archived member."""
+    if zinfo.file_size != os.path.getsize(path):
+        return False
+    if zinfo.date_time == ZipInfo.from_file(path).date_time:
+        return True
+    return zinfo.CRC == _file_crc(path)
 
-    def _arcname(self, file_path, split_on):
-        # Remove root folders and leading slash
-        return str(file_path)\
-                .split(str(split_on))[-1]\
-                .lstrip('/')
 
-    def _rename(self, arcname, new_name):
-        return str(Path(arcname).with_name(new_name))
+def _file_crc(path):
+    crc = 0
+    with open(path, 'rb') as src:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            crc = binascii.crc32(chunk, crc)
+    return crc
@@ -0,0 +1,106 @@
+import asyncio
+import os
+from collections import namedtuple
+
+from .repository import _clone_args
+
+
+SyncResult = namedtuple('SyncResult', ['path', 'url', 'action', 'ok', 'output', 'error'])
+
+
+class RepositoryManager:
+    """Clone, fetch or pull many repositories concurrently.
+
+    Git commands run as asyncio subprocesses, with at most "concurrency"
+    running at once and each one limited to "timeout" seconds. Failures
+    are collected per repository instead of stopping the whole sync.
+
+    USAGE:
+        manager = RepositoryManager(concurrency=8, timeout=600)
+        results = manager.sync([
+            ('/data/repo-1', 'git@github.com:biglocalnews/repo-1.git'),
+            ('/data/repo-2', 'git@github.com:biglocalnews/repo-2.git'),
+        ])
+        failed = [r for r in results if not r.ok]
+    """
+
+    def __init__(self, concurrency=8, timeout=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def sync(self, repos, fetch_only=False, **clone_options):
+        """Sync (path, url) pairs and return a SyncResult for each, in order.
+
+        Repositories that don't exist locally yet are cloned, using any
+        options accepted by Repository.clone. Existing ones are pulled,
+        or only fetched if "fetch_only" is set.
+        """
+        return asyncio.run(self.sync_async(repos, fetch_only=fetch_only, **clone_options))
+
+    async def sync_async(self, repos, fetch_only=False, **clone_options):
+        """Coroutine version of sync, for use inside a running event loop."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def sync_one(path, url):
+            async with semaphore:
+                if not os.path.exists(os.path.join(path, '.git')):
+                    action = 'clone'
+                elif fetch_only:
+                    action = 'fetch'
+                else:
+                    action = 'pull'
+                try:
+                    if action == 'clone':
+                        return await self.clone(path, url, **clone_options)
+                    if action == 'fetch':
+                        return await self.fetch(path, url)
+                    return await self.pull(path, url)
+                except OSError as e:
+                    # e.g. a path under a file, or no permission to create it
+                    return SyncResult(path, url, action, False, '', str(e))
+
+        return await asyncio.gather(*[sync_one(path, url) for path, url in repos])
+
+    async def clone(self, path, url, **options):
+        os.makedirs(path, exist_ok=True)
+        args = ['clone'] + _clone_args(**options) + [url, '.']
+        result = await self._git(path, url, 'clone', args)
+        if result.ok and options.get('sparse_paths'):
+            args = ['sparse-checkout', 'set'] + list(options['sparse_paths'])
+            sparse = await self._git(path, url, 'clone', args)
+            if not sparse.ok:
+                return sparse
+        return result
+
+    async def fetch(self, path, url=None):
+        return await self._git(path, url, 'fetch', ['fetch', '--prune'])
+
+    async def pull(self, path, url=None):
+        return await self._git(path, url, 'pull', ['pull'])
+
+    async def _git(self, path, url, action, args):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                'git', *args,
+                cwd=str(path),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            # Missing git, or a cwd that doesn't exist or isn't a directory
+            return SyncResult(path, url, action, False, '', str(e))
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            error = f"git {args[0]} timed out after {self.timeout} seconds"
+            return SyncResult(path, url, action, False, '', error)
+        finally:
+            # Don't leave git running on timeout or cancellation
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+        output = stdout.decode('utf-8', 'replace')
+        if proc.returncode != 0:
+            error = stderr.decode('utf-8', 'replace').strip()
+            return SyncResult(path, url, action, False, output, error)
+        return SyncResult(path, url, action, True, output, None)
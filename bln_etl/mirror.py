@@ -0,0 +1,147 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from .repository import Repository
+
+
+class MirrorCache:
+    """Local cache of bare mirrors, shared by repeated clones of a remote.
+
+    Each remote URL gets a bare mirror under "root". Clones made through
+    the cache borrow objects from the mirror via git's alternates
+    mechanism, so only objects missing from the mirror are downloaded.
+    Mirrors are updated with fetches only, and the least recently used
+    mirrors are removed once the cache grows past "max_bytes".
+
+    Clones that borrow from an evicted mirror stop working, so pass
+    "dissociate=True" to clone for workspaces that outlive the cache.
+    Mirrors that are being updated or cloned from are never evicted.
+    Fetches for different remotes run concurrently.
+
+    USAGE:
+        cache = MirrorCache('/var/cache/bln-mirrors', max_bytes=20 * 1024**3)
+        repo = cache.clone('git@github.com:biglocalnews/bln-etl.git', '/tmp/etl')
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        # Guards the bookkeeping below, never held across a fetch
+        self._lock = threading.Lock()
+        # Number of updates and clones using each mirror
+        self._users = {}
+        # Serializes fetches into the same mirror
+        self._mirror_locks = {}
+
+    def mirror_path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        return self.root.joinpath(f"{key}.git")
+
+    def update(self, url):
+        """Create or fetch the mirror for a URL and return its path."""
+        mirror = self.mirror_path(url)
+        with self._using(mirror) as mirror_lock:
+            self._update(url, mirror, mirror_lock)
+        return mirror
+
+    def _update(self, url, mirror, mirror_lock):
+        with mirror_lock:
+            if mirror.exists():
+                subprocess.check_output(
+                    ['git', 'remote', 'update', '--prune'],
+                    cwd=str(mirror)
+                )
+            else:
+                self.root.mkdir(parents=True, exist_ok=True)
+                subprocess.check_output(['git', 'clone', '--mirror', url, str(mirror)])
+            # Directory mtime doubles as the last-used time for eviction
+            os.utime(str(mirror))
+        self.evict()
+
+    @contextmanager
+    def _using(self, mirror):
+        """Mark a mirror as in use, so it isn't evicted.
+
+        Yields the lock that serializes fetches into the mirror.
+        """
+        with self._lock:
+            self._users[mirror] = self._users.get(mirror, 0) + 1
+            mirror_lock = self._mirror_locks.setdefault(mirror, threading.Lock())
+        try:
+            yield mirror_lock
+        finally:
+            with self._lock:
+                self._users[mirror] -= 1
+                if not self._users[mirror]:
+                    del self._users[mirror]
+                    del self._mirror_locks[mirror]
+
+    def clone(self, url, dest, dissociate=False, **options):
+        """Clone a URL to dest, borrowing objects from its mirror.
+
+        Accepts the same options as Repository.clone.
+
+        Returns:
+            Repository: The new clone.
+        """
+        mirror = self.mirror_path(url)
+        with self._using(mirror) as mirror_lock:
+            self._update(url, mirror, mirror_lock)
+            Repository.clone_to_dir(
+                url,
+                str(dest),
+                reference=str(mirror),
+                dissociate=dissociate,
+                **options
+            )
+        return Repository(str(dest))
+
+    def mirrors(self):
+        """Mirror paths, least recently used first."""
+        if not self.root.exists():
+            return []
+        return sorted(self.root.glob('*.git'), key=lambda p: p.stat().st_mtime)
+
+    def size(self):
+        return sum(_dir_size(mirror) for mirror in self.mirrors())
+
+    def evict(self, keep=None):
+        """Remove least recently used mirrors until under max_bytes.
+
+        Mirrors in use by an update or clone, and "keep", are skipped.
+
+        Returns:
+            list: Paths of the removed mirrors.
+        """
+        if self.max_bytes is None:
+            return []
+        # Held throughout, so a mirror can't come into use while it's removed
+        with self._lock:
+            sizes = [(mirror, _dir_size(mirror)) for mirror in self.mirrors()]
+            total = sum(size for _, size in sizes)
+            removed = []
+            for mirror, size in sizes:
+                if total <= self.max_bytes:
+                    break
+                if mirror == keep or mirror in self._users:
+                    continue
+                shutil.rmtree(str(mirror))
+                total -= size
+                removed.append(mirror)
+        return removed
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(str(path)):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
@@ -1,15 +1,28 @@
+import json
 import os
+import re
+from datetime import datetime, timezone
 from pathlib import Path
 import subprocess
+import time
+
+
+# Stored in the .git directory to track the last synced commit
+SYNC_STATE_FILE = 'bln_etl_sync.json'
+
+# Read NUL-separated pathspecs from stdin
+PATHSPEC_FROM_STDIN = ['--pathspec-from-file=-', '--pathspec-file-nul']
 
 
 class Repository:
     """Repository is light Python wrapper around basic GIT cli commands.
 
-    The class is a context manager that executes commands in a
-    local repository's directory.
+    Commands are executed in the local repository's directory without
+    changing the process's working directory, so separate Repository
+    instances can safely be used from several threads at once.
 
-    It automatically creates a directory for the repo if it does not yet exist.
+    The class is a context manager that automatically creates a
+    directory for the repo if it does not yet exist.
 
     USAGE:
         with Repository('/path/to/git-repo') as repo:
@@ -21,39 +34,303 @@ class Repository:
         self.path = local_path
 
     def __enter__(self):
-        self.original_path = os.getcwd()
         Path(self.path).mkdir(parents=True, exist_ok=True)
-        os.chdir(self.path)
         return self
 
     def __exit__(self, type, value, traceback):
-        os.chdir(self.original_path)
+        pass
 
     @property
     def initialized(self):
-        return os.path.exists('.git')
+        return os.path.exists(os.path.join(self.path, '.git'))
 
     @staticmethod
-    def clone_to_dir(url, dir):
-        return subprocess.check_output(['git', 'clone', url, dir])
+    def clone_to_dir(url, dir, **options):
+        """Clone a repo to the specified directory.
+
+        See Repository.clone for options.
+        """
+        args = ['git', 'clone'] + _clone_args(**options) + [url, dir]
+        output = subprocess.check_output(args)
+        if options.get('sparse_paths'):
+            _sparse_checkout(dir, options['sparse_paths'])
+        return output
+
+    def clone(self, url, depth=None, branch=None, single_branch=False,
+              filter=None, sparse_paths=None, reference=None, dissociate=False):
+        """Clone a repo into the repository directory.
 
-    def clone(self, url):
-        self.clone_to_dir(url, '.')
+        By default, this is a full clone with complete history. Use the
+        options below to only download the history and files you need.
+
+        Args:
+            depth (int): Only fetch this many commits of history.
+            branch (str): Check out this branch instead of the remote's HEAD.
+            single_branch (bool): Only fetch history for one branch.
+            filter (str): Partial clone filter. "blob:none" skips file
+                contents until they are checked out, "tree:0" skips trees too.
+            sparse_paths (list): Only check out these directories.
+            reference (str): Borrow objects from a local repo (e.g. a
+                MirrorCache mirror) instead of downloading them again.
+            dissociate (bool): Copy borrowed objects after cloning, so the
+                clone keeps working if the reference repo is removed.
+
+        NOTE: Git ignores "depth" for plain local paths; use a file:// URL.
+        """
+        args = _clone_args(
+            depth=depth,
+            branch=branch,
+            single_branch=single_branch,
+            filter=filter,
+            sparse_paths=sparse_paths,
+            reference=reference,
+            dissociate=dissociate,
+        )
+        output = self._git('clone', *args, url, '.')
+        if sparse_paths:
+            _sparse_checkout(self.path, sparse_paths)
+        return output
 
     def init(self):
-        return subprocess.check_output(['git', 'init'])
+        return self._git('init')
+
+    def add(self, paths=None):
+        """Stage changes.
+
+        By default, stages everything with "git add .", which walks the
+        whole working tree. Pass a list of "paths" to only stage those
+        files; they are fed to git in bulk on stdin, so long lists
+        don't hit command-line length limits.
+        """
+        if paths is None:
+            return self._git('add', '.')
+        if not paths:
+            return b''
+        return self._git('add', *PATHSPEC_FROM_STDIN, input=_pathspec(paths))
 
-    def add(self):
-        return subprocess.check_output(['git', 'add', '.'])
+    def commit(self, message, paths=None):
+        """Commit staged changes, or only the given "paths".
 
-    def commit(self, message):
-        return subprocess.check_output(['git', 'commit', '-m', message])
+        Paths are staged before committing, and any other staged
+        changes are left out of the commit. An empty list of paths
+        raises ValueError, since git would commit everything staged.
+
+        Returns:
+            dict: The new commit's "hash" and "branch", plus counts of
+            "files_changed", "insertions" and "deletions".
+        """
+        if paths is None:
+            output = self._git('commit', '-m', message)
+        else:
+            if not paths:
+                raise ValueError("No paths to commit")
+            self.add(paths)
+            output = self._git(
+                'commit', '-m', message, *PATHSPEC_FROM_STDIN,
+                input=_pathspec(paths)
+            )
+        # Stats come from git show, as commit's output includes the subject
+        stats = self._git('show', '--shortstat', '--format=%H', 'HEAD')
+        return _commit_summary(output.decode('utf-8'), stats.decode('utf-8'))
 
     def add_remote(self, repo_url, name='origin'):
-        return subprocess.check_output(['git', 'remote', 'add', name, repo_url])
+        return self._git('remote', 'add', name, repo_url)
 
     def push(self, remote='origin', branch='main'):
-        return subprocess.check_output(['git', 'push', '-u', remote, branch])
+        return self._git('push', '-u', remote, branch)
 
     def pull(self):
-        return subprocess.check_output(['git', 'pull'])
+        return self._git('pull')
+
+    def head(self):
+        """Full hash of the current commit."""
+        return self._git('rev-parse', 'HEAD').decode('utf-8').strip()
+
+    def changes(self, since, until='HEAD'):
+        """Paths that changed between two commits.
+
+        Renames are reported as a deletion plus an addition.
+
+        Returns:
+            dict: Lists of "added", "modified" and "deleted" paths.
+        """
+        output = self._git(
+            'diff', '--name-status', '--no-renames', '-z', since, until
+        ).decode('utf-8')
+        changes = {'added': [], 'modified': [], 'deleted': []}
+        fields = output.split('\0')
+        for status, path in zip(fields[0::2], fields[1::2]):
+            if status == 'A':
+                changes['added'].append(path)
+            elif status == 'D':
+                changes['deleted'].append(path)
+            else:
+                changes['modified'].append(path)
+        return changes
+
+    def changes_since_sync(self, state_file=None):
+        """Paths that changed since the last call to mark_synced.
+
+        If the repo has never been synced, every file at HEAD is
+        reported as added.
+        """
+        state = self.sync_state(state_file)
+        if state:
+            return self.changes(state['commit'])
+        files = self._git('ls-tree', '-r', '-z', '--name-only', 'HEAD').decode('utf-8')
+        return {
+            'added': [f for f in files.split('\0') if f],
+            'modified': [],
+            'deleted': [],
+        }
+
+    def mark_synced(self, commit='HEAD', state_file=None):
+        """Record a commit as the starting point for changes_since_sync.
+
+        State is stored as JSON inside the .git directory by default,
+        so it is never committed. Pass "state_file" to store it elsewhere.
+        """
+        commit = self._git('rev-parse', commit).decode('utf-8').strip()
+        state = {
+            'commit': commit,
+            'synced_at': datetime.now(timezone.utc).isoformat(),
+        }
+        with open(self._state_path(state_file), 'w') as fh:
+            json.dump(state, fh)
+        return state
+
+    def sync_state(self, state_file=None):
+        """The last recorded sync point, or None."""
+        path = self._state_path(state_file)
+        if not os.path.exists(path):
+            return None
+        with open(path) as fh:
+            return json.load(fh)
+
+    def commit_time(self, treeish='HEAD'):
+        """Unix timestamp of a commit, or the current time for bare trees."""
+        try:
+            output = self._git('show', '-s', '--format=%ct', f'{treeish}^{{commit}}')
+        except subprocess.CalledProcessError:
+            return time.time()
+        return int(output.decode('utf-8').strip())
+
+    def iter_blobs(self, treeish='HEAD', paths=None, chunk_size=1024 * 1024):
+        """Stream the files in a commit or tree straight from git's object store.
+
+        Yields (path, mode, size, chunks) for each file, where "chunks"
+        is an iterator over the file's bytes. Each file's chunks must be
+        consumed before moving on to the next file; anything left over is
+        skipped. Submodules are ignored.
+        """
+        args = ['ls-tree', '-r', '-z', '--long', treeish]
+        if paths:
+            args += ['--'] + list(paths)
+        entries = []
+        for line in self._git(*args).decode('utf-8').split('\0'):
+            if not line:
+                continue
+            meta, path = line.split('\t', 1)
+            mode, kind, sha, size = meta.split()
+            if kind == 'blob':
+                entries.append((path, int(mode, 8), sha, int(size)))
+        proc = subprocess.Popen(
+            ['git', 'cat-file', '--batch'],
+            cwd=str(self.path),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        try:
+            for path, mode, sha, size in entries:
+                proc.stdin.write(f'{sha}\n'.encode('utf-8'))
+                proc.stdin.flush()
+                # Header is "<sha> <type> <size>"
+                proc.stdout.readline()
+                chunks = _read_blob(proc.stdout, size, chunk_size)
+                yield path, mode, size, chunks
+                for _ in chunks:
+                    pass
+                # Each object is followed by a newline
+                proc.stdout.read(1)
+        finally:
+            proc.stdin.close()
+            proc.stdout.close()
+            proc.wait()
+
+    def _state_path(self, state_file=None):
+        if state_file:
+            return state_file
+        path = self._git('rev-parse', '--git-path', SYNC_STATE_FILE).decode('utf-8').strip()
+        return os.path.join(self.path, path)
+
+    def _git(self, *args, input=None):
+        if input is None:
+            return subprocess.check_output(['git'] + list(args), cwd=str(self.path))
+        return subprocess.check_output(
+            ['git'] + list(args),
+            cwd=str(self.path),
+            input=input
+        )
+
+
+def _clone_args(depth=None, branch=None, single_branch=False,
+                filter=None, sparse_paths=None, reference=None, dissociate=False):
+    args = []
+    if depth:
+        args.extend(['--depth', str(depth)])
+    if branch:
+        args.extend(['--branch', branch])
+    if single_branch:
+        args.append('--single-branch')
+    if filter:
+        args.append(f'--filter={filter}')
+    if sparse_paths:
+        args.append('--sparse')
+    if reference:
+        args.extend(['--reference', str(reference)])
+    if dissociate:
+        args.append('--dissociate')
+    return args
+
+
+def _sparse_checkout(path, paths):
+    return subprocess.check_output(
+        ['git', 'sparse-checkout', 'set'] + list(paths),
+        cwd=str(path)
+    )
+
+
+def _pathspec(paths):
+    # Literal paths, so names with glob characters aren't expanded
+    return b'\0'.join(
+        f':(literal){path}'.encode('utf-8') for path in paths
+    )
+
+
+def _commit_summary(output, stats):
+    """Summarize a commit from git commit's output and git show's stats."""
+    lines = stats.strip().splitlines()
+    summary = {
+        'hash': lines[0].strip() if lines else None,
+        'branch': None,
+        'files_changed': 0,
+        'insertions': 0,
+        'deletions': 0,
+    }
+    match = re.match(r'\[(\S+)', output)
+    if match:
+        summary['branch'] = match.group(1)
+    for count, field in re.findall(r'(\d+) (file|insertion|deletion)', '\n'.join(lines[1:])):
+        key = 'files_changed' if field == 'file' else f'{field}s'
+        summary[key] = int(count)
+    return summary
+
+
+def _read_blob(stream, size, chunk_size):
+    remaining = size
+    while remaining:
+        chunk = stream.read(min(chunk_size, remaining))
+        if not chunk:
+            raise EOFError("git cat-file output ended early")
+        remaining -= len(chunk)
+        yield chunk
@@ -1,5 +1,10 @@
+import gzip
+import json
 import shutil
 import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 import pytest
@@ -57,12 +62,12 @@ def read_fixture(file_name):
     return file_contents(path)
 
 
-def repo_status():
-    return subprocess.check_output(['git', 'status']).decode('utf-8')
+def repo_status(path):
+    return subprocess.check_output(['git', 'status'], cwd=path).decode('utf-8')
 
 
-def repo_log(num=1):
-    return subprocess.check_output(['git', 'log']).decode('utf-8')
+def repo_log(path, num=1):
+    return subprocess.check_output(['git', 'log'], cwd=path).decode('utf-8')
 
 
 # Fixtures
@@ -101,3 +106,176 @@ def working_dir(tmp_path):
 @pytest.fixture
 def create_working_dir(working_dir):
     Path(working_dir).mkdir(parents=True, exist_ok=True)
+
+
+@pytest.fixture
+def git_identity(monkeypatch):
+    for var in ['GIT_AUTHOR', 'GIT_COMMITTER']:
+        monkeypatch.setenv(f'{var}_NAME', 'BLN Test')
+        monkeypatch.setenv(f'{var}_EMAIL', 'test@example.com')
+
+
+@pytest.fixture
+def source_repo(tmp_path, git_identity):
+    "A local repo with a couple of commits, for clone and sync tests"
+    path = tmp_path.joinpath('source-repo')
+    path.mkdir()
+
+    def git(*args):
+        return subprocess.check_output(['git'] + list(args), cwd=str(path))
+    git('init', '-b', 'main')
+    git('config', 'uploadpack.allowFilter', 'true')
+    path.joinpath('README.md').write_text('Source repo')
+    path.joinpath('data').mkdir()
+    path.joinpath('data', 'a.csv').write_text('id\n1\n')
+    git('add', '.')
+    git('commit', '-m', 'Initial commit')
+    path.joinpath('docs').mkdir()
+    path.joinpath('docs', 'notes.txt').write_text('Some notes')
+    path.joinpath('data', 'b.csv').write_text('id\n2\n')
+    git('add', '.')
+    git('commit', '-m', 'Add more data')
+    return path
+
+
+class StubRequest:
+
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        body = self.body
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        request = StubRequest(self.command, self.path, dict(self.headers), body)
+        server = self.server
+        with server.lock:
+            server.requests.append(request)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(server.delay)
+            status, headers, content = server.respond(request)
+        finally:
+            with server.lock:
+                server.active -= 1
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    "Local stand-in for the BLN GraphQL API"
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.delay = 0
+        # Callable taking a GraphQL payload and returning a response dict
+        self.graphql = lambda payload: {'data': {}}
+        # Bodies PUT to /upload/<name>, and how many PUTs to fail first
+        self.uploads = {}
+        self.upload_failures = 0
+        # Bytes received so far by resumable sessions at /session/<name>
+        self.sessions = {}
+        # Fail every resumable chunk PUT without keeping its bytes
+        self.reject_chunks = False
+        # Refuse to start sessions, as storage does for URIs signed for PUT
+        self.refuse_sessions = False
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def upload_uri(self, name):
+        return f'{self.url}/upload/{name}'
+
+    def respond(self, request):
+        if request.path.startswith('/upload/'):
+            return self.upload(request)
+        if request.path.startswith('/session/'):
+            return self.resumable_upload(request)
+        body = json.dumps(self.graphql(request.json())).encode('utf-8')
+        return 200, {'Content-Type': 'application/json'}, body
+
+    def upload(self, request):
+        name = request.path[len('/upload/'):]
+        if request.headers.get('x-goog-resumable') == 'start':
+            if self.refuse_sessions:
+                return 403, {}, b''
+            with self.lock:
+                self.sessions[name] = bytearray()
+            return 201, {'Location': f'{self.url}/session/{name}'}, b''
+        with self.lock:
+            if self.upload_failures:
+                self.upload_failures -= 1
+                return 503, {}, b''
+            self.uploads[name] = request.body
+        return 200, {}, b''
+
+    def resumable_upload(self, request):
+        "GCS-style resumable session: Content-Range chunks, 308 until complete"
+        name = request.path[len('/session/'):]
+        byte_range, total = request.headers['Content-Range'][len('bytes '):].split('/')
+        total = int(total)
+        with self.lock:
+            received = self.sessions[name]
+            if byte_range == '*' and self.upload_failures:
+                self.upload_failures -= 1
+                return 503, {}, b''
+            if byte_range != '*' and self.reject_chunks:
+                return 503, {}, b''
+            if byte_range != '*':
+                start = int(byte_range.split('-')[0])
+                assert start == len(received)
+                received.extend(request.body)
+                if self.upload_failures:
+                    # Keep the bytes but lose the response
+                    self.upload_failures -= 1
+                    return 503, {}, b''
+            if len(received) == total:
+                self.uploads[name] = bytes(received)
+                return 200, {}, b''
+            headers = {'Range': f'bytes=0-{len(received) - 1}'} if received else {}
+            return 308, headers, b''
+
+
+@pytest.fixture
+def api_server(monkeypatch):
+    from bln_etl.api.client import Base
+    server = StubServer()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    monkeypatch.setattr(Base, 'endpoint', f'{server.url}/graphql')
+    monkeypatch.setattr(Base, 'backoff_factor', 0)
+    monkeypatch.setenv('BLN_API_KEY', 'test-token')
+    Base.cache.clear()
+    yield server
+    Base.cache.clear()
+    server.shutdown()
+    server.server_close()
+    Base.close_sessions()
@@ -1,8 +1,15 @@
+import hashlib
 import os
+import time
+from unittest import mock
 
 import pytest
+import requests
 
 from bln_etl.api import Client, Project
+from bln_etl.api.cache import TTLCache
+from bln_etl.api.client import ApiError, Base, BlnClientWrapper
+from bln_etl.api.queries import PROJECT_QUERY
 from .conftest import fixture_path
 
 TOKEN=os.environ.get('BLN_API_KEY')
@@ -108,3 +115,442 @@ def test_project_file_delete():
             f.delete()
     actual = [f.name for f in project.files]
     assert 'test.json' not in actual
+
+
+def _response(status, payload=None):
+    resp = mock.Mock(status_code=status)
+    resp.json.return_value = payload
+    return resp
+
+
+def test_post_reuses_session():
+    "should share one pooled session per token"
+    Base.close_sessions()
+    assert Base.session('a') is Base.session('a')
+    assert Base.session('a') is not Base.session('b')
+    assert Base.session('a').headers['Authorization'] == 'JWT a'
+    Base.close_sessions()
+
+
+def test_post_retries_queries():
+    "should retry queries on transient errors with backoff"
+    query = {'query': 'query { me { id } }'}
+    responses = [
+        requests.ConnectionError(),
+        _response(503),
+        _response(200, {'data': {}}),
+    ]
+    with mock.patch.object(requests.Session, 'post', side_effect=responses) as post, \
+         mock.patch('bln_etl.api.client.time.sleep') as sleep:
+        assert Base.post('token', query) == {'data': {}}
+    assert post.call_count == 3
+    post.assert_called_with(Base.endpoint, json=query, timeout=Base.timeout)
+    assert sleep.mock_calls == [mock.call(0.5), mock.call(1.0)]
+    Base.close_sessions()
+
+
+def test_post_gives_up():
+    "should raise ApiError once retries are exhausted"
+    query = {'query': 'query { me { id } }'}
+    with mock.patch.object(requests.Session, 'post', return_value=_response(502)) as post, \
+         mock.patch('bln_etl.api.client.time.sleep'):
+        with pytest.raises(ApiError):
+            Base.post('token', query)
+    assert post.call_count == Base.max_retries + 1
+    Base.close_sessions()
+
+
+def test_post_does_not_retry_mutations():
+    "should send mutations only once"
+    mutation = {'query': 'mutation { deleteFile { ok } }'}
+    with mock.patch.object(requests.Session, 'post', side_effect=requests.ConnectionError()) as post, \
+         mock.patch('bln_etl.api.client.time.sleep'):
+        with pytest.raises(requests.ConnectionError):
+            Base.post('token', mutation)
+    assert post.call_count == 1
+    Base.close_sessions()
+
+
+def test_project_get_many(api_server):
+    "should pack lookups into batched, aliased queries"
+    def resolver(payload):
+        variables = payload['variables']
+        data = {}
+        for key, uuid in variables.items():
+            alias = 'p' + key[2:]
+            data[alias] = None if uuid.startswith('missing') else {
+                'id': uuid,
+                'name': f'Project {uuid}',
+                'description': '',
+                'contact': None,
+                'contactMethod': 'EMAIL',
+                'updatedAt': '2021-01-01',
+                'isOpen': True,
+            }
+        return {'data': data}
+    api_server.graphql = resolver
+    uuids = ['a', 'missing-1', 'b', 'c', 'missing-2']
+    projects = Project.get_many(uuids, batch_size=2)
+    assert [p and p.id for p in projects] == ['a', None, 'b', 'c', None]
+    assert len(api_server.requests) == 3
+    assert 'p1: node(id: $id1)' in api_server.requests[0].json()['query']
+    assert Project.get_many([]) == []
+
+
+def paged_resolver(total):
+    "Serve open projects in pages, following first/after cursors"
+    def resolver(payload):
+        first = payload['variables']['first']
+        start = int(payload['variables']['after'] or 0)
+        end = min(start + first, total)
+        edges = [{'node': {
+            'id': f'project-{i}',
+            'name': f'Project {i}',
+            'description': '',
+            'contact': None,
+            'contactMethod': 'EMAIL',
+            'updatedAt': '2021-01-01',
+            'isOpen': True,
+        }} for i in range(start, end)]
+        page_info = {'hasNextPage': end < total, 'endCursor': str(end)}
+        return {'data': {'openProjects': {'pageInfo': page_info, 'edges': edges}}}
+    return resolver
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_iter_open_projects(api_server, prefetch):
+    "should page through projects with cursors"
+    api_server.graphql = paged_resolver(5)
+    client = Client()
+    projects = client.iter_open_projects(page_size=2, prefetch=prefetch)
+    assert next(projects).id == 'project-0'
+    assert [p.id for p in projects] == [f'project-{i}' for i in range(1, 5)]
+    assert [r.json()['variables'] for r in api_server.requests] == [
+        {'first': 2, 'after': None},
+        {'first': 2, 'after': '2'},
+        {'first': 2, 'after': '4'},
+    ]
+
+
+def test_iter_open_projects_is_lazy(api_server):
+    "should only request pages as they are consumed"
+    api_server.graphql = paged_resolver(5)
+    projects = Client().iter_open_projects(page_size=2)
+    next(projects)
+    assert len(api_server.requests) == 1
+    projects.close()
+
+
+def files_resolver(files):
+    def resolver(payload):
+        if 'deleteFile' in payload['query']:
+            name = payload['variables']['input']['fileName']
+            files.remove(name)
+            return {'data': {'deleteFile': {'ok': True, 'err': None}}}
+        node = {
+            'id': payload['variables']['id'],
+            'name': 'Cached',
+            'description': '',
+            'contact': None,
+            'contactMethod': 'EMAIL',
+            'updatedAt': '2021-01-01',
+            'isOpen': True,
+        }
+        if 'files' in payload['query']:
+            node['files'] = [{'name': name} for name in files]
+        return {'data': {'node': node}}
+    return resolver
+
+
+def test_cached_files(api_server):
+    "should reuse project lookups and file listings until invalidated"
+    api_server.graphql = files_resolver(['a.csv', 'b.csv'])
+    project = Project.get('project-1')
+    assert Project.get('project-1').name == 'Cached'
+    if project.files:
+        assert [f.name for f in project.files] == ['a.csv', 'b.csv']
+    assert len(api_server.requests) == 2
+    # Deleting a file drops the cached listing
+    project.files[0].delete()
+    assert [f.name for f in project.files] == ['b.csv']
+    assert len(api_server.requests) == 4
+    project.invalidate()
+    Project.get('project-1')
+    assert len(api_server.requests) == 5
+
+
+def test_cache_expiry(api_server, monkeypatch):
+    api_server.graphql = files_resolver(['a.csv'])
+    now = time.time()
+    monkeypatch.setattr('bln_etl.api.cache.time.time', lambda: now)
+    Project.get('project-1')
+    Project.get('project-1')
+    assert len(api_server.requests) == 1
+    monkeypatch.setattr('bln_etl.api.cache.time.time', lambda: now + Base.cache.ttl + 1)
+    Project.get('project-1')
+    assert len(api_server.requests) == 2
+
+
+def test_disk_cache(api_server, monkeypatch, tmp_path):
+    "should share entries across cache instances through a file"
+    api_server.graphql = files_resolver(['a.csv'])
+    path = tmp_path.joinpath('cache', 'api.json')
+    monkeypatch.setattr(Base, 'cache', TTLCache(ttl=300, path=str(path)))
+    project = Project.get('project-1')
+    project.files
+    monkeypatch.setattr(Base, 'cache', TTLCache(ttl=300, path=str(path)))
+    project = Project.get('project-1')
+    assert [f.name for f in project.files] == ['a.csv']
+    assert len(api_server.requests) == 2
+    assert 'test-token' not in path.read_text()
+
+
+def test_files_query_selects_names_only(api_server):
+    api_server.graphql = files_resolver(['a.csv'])
+    project = Project('Test', uuid='project-1')
+    assert [f.name for f in project.files] == ['a.csv']
+    query = api_server.requests[0].json()['query']
+    assert 'files {' in query
+    assert 'description' not in query
+
+
+def test_project_get_fields(api_server):
+    "should only request the given fields"
+    api_server.graphql = files_resolver([])
+    project = Project.get('project-1', fields=['is_open'])
+    assert project.is_open is True
+    query = api_server.requests[0].json()['query']
+    assert 'isOpen' in query
+    assert 'description' not in query
+
+
+def test_persisted_queries(api_server, monkeypatch):
+    "should send query hashes, registering unknown ones"
+    known = set()
+    resolver = files_resolver([])
+
+    def apq(payload):
+        digest = payload['extensions']['persistedQuery']['sha256Hash']
+        if 'query' not in payload:
+            if digest not in known:
+                return {'errors': [{'message': 'PersistedQueryNotFound'}]}
+        else:
+            assert hashlib.sha256(payload['query'].encode('utf-8')).hexdigest() == digest
+            known.add(digest)
+        return resolver(dict(payload, query=PROJECT_QUERY))
+    api_server.graphql = apq
+    monkeypatch.setattr(Base, 'persisted_queries', True)
+    assert Project.get('project-1').name == 'Cached'
+    assert Project.get('project-2').name == 'Cached'
+    sent = [r.json() for r in api_server.requests]
+    assert ['query' in payload for payload in sent] == [False, True, False]
+
+
+def test_compressed_requests(api_server, monkeypatch):
+    "should gzip request bodies over the size threshold"
+    resolver = files_resolver([])
+
+    def batch_resolver(payload):
+        variables = payload['variables']
+        if 'id' in variables:
+            return resolver(payload)
+        return {'data': {
+            'p' + key[2:]: resolver({'query': '', 'variables': {'id': uuid}})['data']['node']
+            for key, uuid in variables.items()
+        }}
+    api_server.graphql = batch_resolver
+    monkeypatch.setattr(Base, 'compress_requests', True)
+    monkeypatch.setattr(Base, 'compress_min_size', 300)
+    Project.get('project-1', fields=['is_open'])
+    assert [p.id for p in Project.get_many(['project-1', 'project-2'])] == \
+        ['project-1', 'project-2']
+    encodings = [r.headers.get('Content-Encoding') for r in api_server.requests]
+    assert encodings == [None, 'gzip']
+    assert api_server.requests[1].json()['variables'] == {'id0': 'project-1', 'id1': 'project-2'}
+
+
+def upload_resolver(server, fail_names=(), uri_type='PUT'):
+    def resolver(payload):
+        name = payload['variables']['input']['fileName']
+        if name in fail_names:
+            return {'data': {'createFileUploadUri': {'ok': None, 'err': 'not allowed'}}}
+        ok = {'name': name, 'uri': server.upload_uri(name), 'uriType': uri_type}
+        return {'data': {'createFileUploadUri': {'ok': ok, 'err': None}}}
+    return resolver
+
+
+def test_upload_files(api_server, tmp_path):
+    "should upload files concurrently and report results per file"
+    api_server.graphql = upload_resolver(api_server, fail_names=['denied.csv'])
+    api_server.delay = 0.05
+    paths = []
+    for i in range(6):
+        path = tmp_path.joinpath(f'data-{i}.csv')
+        path.write_text(f'id\n{i}\n')
+        paths.append(str(path))
+    tmp_path.joinpath('empty.csv').write_text('')
+    tmp_path.joinpath('denied.csv').write_text('id\n')
+    paths += [str(tmp_path.joinpath(name)) for name in ['empty.csv', 'denied.csv', 'missing.csv']]
+    project = Project('Test', uuid='project-1')
+    results = project.upload_files(paths, concurrency=3, retries=1)
+    assert [r.path for r in results] == paths
+    assert [r.ok for r in results] == [True] * 7 + [False, False]
+    assert results[-2].error == 'not allowed'
+    assert results[-2].attempts == 2
+    assert results[-1].error.startswith('invalid path')
+    assert api_server.uploads['data-3.csv'] == b'id\n3\n'
+    assert api_server.uploads['empty.csv'] == b''
+    assert 1 < api_server.max_active <= 3
+    # Storage uploads don't carry the API token
+    puts = [r for r in api_server.requests if r.method == 'PUT']
+    assert not any('Authorization' in r.headers for r in puts)
+
+
+def test_upload_files_retries(api_server, tmp_path):
+    "should retry failed uploads with a fresh upload URI"
+    api_server.graphql = upload_resolver(api_server)
+    api_server.upload_failures = 2
+    path = tmp_path.joinpath('test.csv')
+    path.write_text('id\n1\n')
+    results = Project('Test', uuid='project-1').upload_files([str(path)], retries=2)
+    assert results[0].ok
+    assert results[0].attempts == 3
+    assert api_server.uploads['test.csv'] == b'id\n1\n'
+    assert len([r for r in api_server.requests if r.method == 'POST']) == 3
+
+
+def test_upload_progress(api_server, tmp_path, monkeypatch):
+    "should stream files in chunks and report progress"
+    api_server.graphql = upload_resolver(api_server)
+    monkeypatch.setattr(BlnClientWrapper, 'chunk_size', 1000)
+    path = tmp_path.joinpath('big.csv')
+    content = os.urandom(4500)
+    path.write_bytes(content)
+    calls = []
+    results = Project('Test', uuid='project-1').upload_files(
+        [str(path)],
+        progress=lambda *args: calls.append(args)
+    )
+    assert results[0].ok
+    assert api_server.uploads['big.csv'] == content
+    assert calls[-1] == ('big.csv', 4500, 4500)
+    assert [sent for _, sent, _ in calls] == sorted(sent for _, sent, _ in calls)
+    assert all(b - a <= 1000 for a, b in zip([0] + [c[1] for c in calls], [c[1] for c in calls]))
+
+
+def test_resumable_upload(api_server, tmp_path, monkeypatch):
+    "should resume an interrupted session from the bytes the server kept"
+    api_server.graphql = upload_resolver(api_server, uri_type='POST')
+    api_server.upload_failures = 2
+    monkeypatch.setattr(BlnClientWrapper, 'chunk_size', 1024)
+    path = tmp_path.joinpath('big.csv')
+    content = os.urandom(5000)
+    path.write_bytes(content)
+    tmp_path.joinpath('empty.csv').write_bytes(b'')
+    calls = []
+    results = Project('Test', uuid='project-1').upload_files(
+        [str(path), str(tmp_path.joinpath('empty.csv'))],
+        concurrency=1,
+        resumable=True,
+        progress=lambda *args: calls.append(args)
+    )
+    assert [r.ok for r in results] == [True, True]
+    # Resumed within the same session rather than starting over
+    assert results[0].attempts == 1
+    assert api_server.uploads['big.csv'] == content
+    assert api_server.uploads['empty.csv'] == b''
+    chunks = [r for r in api_server.requests if r.path == '/session/big.csv']
+    assert max(len(r.body) for r in chunks) == 1024
+    # 5 chunks plus a status check after each lost response
+    assert len(chunks) == 7
+    assert ('big.csv', 5000, 5000) in calls
+    assert calls[-1] == ('empty.csv', 0, 0)
+
+
+def test_resumable_upload_gives_up(api_server, tmp_path, monkeypatch):
+    api_server.graphql = upload_resolver(api_server, uri_type='POST')
+    api_server.upload_failures = 10
+    monkeypatch.setattr(BlnClientWrapper, 'chunk_size', 1024)
+    path = tmp_path.joinpath('big.csv')
+    path.write_bytes(os.urandom(3000))
+    results = Project('Test', uuid='project-1').upload_files(
+        [str(path)], retries=1, resumable=True
+    )
+    assert not results[0].ok
+    assert results[0].attempts == 2
+    assert '503' in results[0].error
+
+
+def test_resumable_upload_stops_when_chunks_keep_failing(api_server, tmp_path, monkeypatch):
+    "should give up when status checks succeed but no chunk ever lands"
+    api_server.graphql = upload_resolver(api_server, uri_type='POST')
+    api_server.reject_chunks = True
+    monkeypatch.setattr(BlnClientWrapper, 'chunk_size', 1024)
+    path = tmp_path.joinpath('big.csv')
+    path.write_bytes(os.urandom(3000))
+    results = Project('Test', uuid='project-1').upload_files(
+        [str(path)], retries=1, resumable=True
+    )
+    assert not results[0].ok
+    assert results[0].attempts == 2
+    assert '503' in results[0].error
+    # Per attempt: chunk, status check, chunk
+    session_requests = [r for r in api_server.requests if r.path.startswith('/session/')]
+    assert len(session_requests) == 6
+
+
+@pytest.mark.parametrize('uri_type', ['PUT', None])
+def test_resumable_upload_falls_back_to_put(api_server, tmp_path, uri_type):
+    "should send a single PUT when the upload URI can't start a session"
+    api_server.graphql = upload_resolver(api_server, uri_type=uri_type)
+    api_server.refuse_sessions = True
+    path = tmp_path.joinpath('big.csv')
+    content = os.urandom(3000)
+    path.write_bytes(content)
+    results = Project('Test', uuid='project-1').upload_files(
+        [str(path)], retries=0, resumable=True
+    )
+    assert results[0].ok
+    assert results[0].attempts == 1
+    assert api_server.uploads['big.csv'] == content
+    starts = [r for r in api_server.requests if r.path.startswith('/upload/') and r.method == 'POST']
+    # Known PUT-only URIs skip the session attempt altogether
+    assert len(starts) == (0 if uri_type == 'PUT' else 1)
+    assert not any(r.path.startswith('/session/') for r in api_server.requests)
+
+
+def test_upload_uses_client_endpoint_and_auth(api_server, tmp_path):
+    "should request upload URIs from the wrapper's endpoint with its auth method"
+    api_server.graphql = upload_resolver(api_server)
+    path = tmp_path.joinpath('test.csv')
+    path.write_text('id\n1\n')
+    client = BlnClientWrapper('plugin-token', actor='user_plugin')
+    assert client.endpoint == Base.endpoint
+    client.endpoint = f'{api_server.url}/plugin-graphql'
+    results = client.upload_files('project-1', [str(path)])
+    assert results[0].ok
+    post = [r for r in api_server.requests if r.method == 'POST'][0]
+    assert post.path == '/plugin-graphql'
+    assert post.headers['Authorization'] == 'Bearer plugin-token'
+    assert BlnClientWrapper('token', tier='dev').endpoint == 'https://dev-api.biglocalnews.org/graphql'
+
+
+def test_upload_os_errors_per_file(api_server, tmp_path, monkeypatch):
+    "should report unreadable files without losing the other results"
+    api_server.graphql = upload_resolver(api_server)
+    paths = []
+    for name in ['a.csv', 'locked.csv', 'b.csv']:
+        path = tmp_path.joinpath(name)
+        path.write_text('id\n1\n')
+        paths.append(str(path))
+    put = BlnClientWrapper._put
+
+    def locked_put(self, path, uri, progress=None):
+        if path.endswith('locked.csv'):
+            raise PermissionError(13, 'Permission denied', path)
+        return put(self, path, uri, progress)
+    monkeypatch.setattr(BlnClientWrapper, '_put', locked_put)
+    results = Project('Test', uuid='project-1').upload_files(paths, retries=0)
+    assert [r.ok for r in results] == [True, False, True]
+    assert 'Permission denied' in results[1].error
+    assert sorted(api_server.uploads) == ['a.csv', 'b.csv']
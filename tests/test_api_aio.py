@@ -0,0 +1,123 @@
+import asyncio
+
+from bln_etl.api import aio
+
+
+def project_node(i):
+    return {
+        'id': f'project-{i}',
+        'name': f'Project {i}',
+        'description': '',
+        'contact': 'test@example.com',
+        'contactMethod': 'EMAIL',
+        'createdAt': '2021-01-01',
+        'updatedAt': '2021-01-02',
+        'isOpen': False,
+    }
+
+
+def resolver(payload):
+    query = payload['query']
+    if 'effectiveProjectRoles' in query:
+        edges = [{'node': {'role': 'ADMIN', 'project': project_node(i)}} for i in range(3)]
+        return {'data': {'user': {'effectiveProjectRoles': {'edges': edges}}}}
+    if 'deleteFile' in query:
+        return {'data': {'deleteFile': {'ok': True, 'err': None}}}
+    if 'files' in query:
+        project_id = payload['variables']['id']
+        files = [{'name': f'{project_id}.csv'}]
+        return {'data': {'node': dict(project_node(0), id=project_id, files=files)}}
+    uuid = payload['variables']['id']
+    if uuid == 'missing':
+        return {'data': {'node': None}}
+    return {'data': {'node': dict(project_node(0), id=uuid)}}
+
+
+def test_user_projects_and_files(api_server):
+    "should fetch projects, then their files concurrently"
+    api_server.graphql = resolver
+
+    async def main():
+        client = aio.Client(api_token='test-token')
+        projects = await client.user_projects()
+        files = await asyncio.gather(*[p.files() for p in projects])
+        return projects, files
+
+    projects, files = asyncio.run(main())
+    assert [p.name for p in projects] == ['Project 0', 'Project 1', 'Project 2']
+    assert projects[0].user_role == 'ADMIN'
+    assert isinstance(projects[0], aio.Project)
+    assert [[f.name for f in fs] for fs in files] == \
+        [['project-0.csv'], ['project-1.csv'], ['project-2.csv']]
+    assert api_server.requests[0].headers['Authorization'] == 'JWT test-token'
+
+
+def test_get_and_delete(api_server):
+    api_server.graphql = resolver
+
+    async def main():
+        project = await aio.Project.get('project-7')
+        missing = await aio.Project.get('missing')
+        files = await project.files()
+        deleted = await files[0].delete()
+        return project, missing, deleted
+
+    project, missing, deleted = asyncio.run(main())
+    assert project.id == 'project-7'
+    assert missing is None
+    assert deleted == {'data': {'deleteFile': {'ok': True, 'err': None}}}
+    assert api_server.requests[-1].json()['variables']['input'] == \
+        {'fileName': 'project-7.csv', 'projectId': 'project-7'}
+
+
+def test_bounded_concurrency(api_server):
+    "should keep at most engine.concurrency requests in flight"
+    api_server.graphql = resolver
+    api_server.delay = 0.05
+    engine = aio.Engine(concurrency=3)
+
+    async def main():
+        client = aio.Client(engine=engine)
+        return await asyncio.gather(*[
+            client.engine.post(client.api_token, {'query': 'query { x }', 'variables': {'id': str(i)}})
+            for i in range(10)
+        ])
+
+    try:
+        results = asyncio.run(main())
+    finally:
+        engine.shutdown()
+    assert len(results) == 10
+    assert 1 < api_server.max_active <= 3
+
+
+def test_get_many(api_server):
+    "should send batches concurrently and keep input order"
+    def batch_resolver(payload):
+        return {'data': {
+            'p' + key[2:]: None if uuid == 'missing' else dict(project_node(0), id=uuid)
+            for key, uuid in payload['variables'].items()
+        }}
+    api_server.graphql = batch_resolver
+    uuids = [f'project-{i}' for i in range(7)] + ['missing']
+    projects = asyncio.run(aio.Project.get_many(uuids, batch_size=3))
+    assert [p and p.id for p in projects] == uuids[:-1] + [None]
+    assert len(api_server.requests) == 3
+
+
+def test_iter_user_projects(api_server):
+    "should follow page cursors"
+    def paged(payload):
+        start = int(payload['variables']['after'] or 0)
+        edges = [{'node': {'role': 'ADMIN', 'project': project_node(start)}}]
+        page_info = {'hasNextPage': start < 2, 'endCursor': str(start + 1)}
+        connection = {'pageInfo': page_info, 'edges': edges}
+        return {'data': {'user': {'effectiveProjectRoles': connection}}}
+    api_server.graphql = paged
+
+    async def main():
+        client = aio.Client()
+        return [p.id async for p in client.iter_user_projects(page_size=1)]
+
+    assert asyncio.run(main()) == ['project-0', 'project-1', 'project-2']
+    assert len(api_server.requests) == 3
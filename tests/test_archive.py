@@ -1,7 +1,14 @@
+import hashlib
+import json
+import os
 import shutil
+import subprocess
+import sys
 from pathlib import Path
-from zipfile import ZipFile
-from bln_etl import Archive
+from zipfile import ZipFile, ZipInfo, ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED
+
+import pytest
+from bln_etl import Archive, ArchiveStream, CompressionPolicy, Repository
 from .conftest import fixture_path
 
 
@@ -149,3 +156,454 @@ def test_extractall_to_path(tmp_path):
     expected = ['test.csv', 'test2.csv']
     actual = [f.name for f in alt_path.glob('*')]
     assert expected == actual
+
+
+def test_add_dir_parallel(tmp_path):
+    "should compress files on a worker pool and produce a readable zip"
+    pth = Path(tmp_path, 'archive.zip')
+    target_dir = fixture_path('files')
+    archive = Archive(pth)
+    archive.add_dir(target_dir, workers=4)
+    serial = Archive(Path(tmp_path, 'serial.zip'))
+    serial.add_dir(target_dir)
+    assert archive.list() == serial.list()
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+        expected = Path(fixture_path('files/nested/test3.csv')).read_bytes()
+        assert zfile.read('nested/test3.csv') == expected
+    archive.extractall(path=Path(tmp_path, 'out'))
+    assert Path(tmp_path, 'out', 'test.json').exists()
+
+
+def test_add_many(tmp_path):
+    "should add files with per-file options in one pass"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth)
+    archive.add_many([
+        fixture_path('test.csv'),
+        {'path': fixture_path('files/test2.csv'), 'rename': 'bar.csv'},
+        {'path': fixture_path('files/nested/test3.csv'), 'drop_root': 'files'},
+    ])
+    files = ZipFile(pth).namelist()
+    assert files == ['test.csv', 'bar.csv', 'nested/test3.csv']
+
+
+def test_writer(tmp_path):
+    "should support batching writes in a context manager"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth)
+    archive.add(fixture_path('test2.csv'))
+    with archive.writer(mode='w') as writer:
+        writer.add(fixture_path('test.csv'), rename='foo.csv')
+        writer.add_dir(fixture_path('files/nested'))
+    assert archive.list() == ['foo.csv', 'test3.csv']
+
+
+def test_add_dir_incremental(tmp_path):
+    "should only write new or changed files and replace stale copies"
+    src = Path(tmp_path, 'src')
+    shutil.copytree(fixture_path('files'), str(src))
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth)
+    stats = archive.add_dir(src, incremental=True)
+    assert stats == {'added': 4, 'skipped': 0, 'replaced': 0}
+    # No changes
+    stats = archive.add_dir(src, incremental=True)
+    assert stats == {'added': 0, 'skipped': 4, 'replaced': 0}
+    assert len(archive.list()) == 4
+    # One changed file and one new file
+    src.joinpath('test.csv').write_text('id,name\n1,changed\n2,rows\n')
+    src.joinpath('new.csv').write_text('id\n1\n')
+    stats = archive.add_dir(src, incremental=True)
+    assert stats == {'added': 1, 'skipped': 3, 'replaced': 1}
+    files = archive.list()
+    assert sorted(files) == sorted(set(files))
+    assert len(files) == 5
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.read('test.csv') == b'id,name\n1,changed\n2,rows\n'
+        assert zfile.read('nested/test3.csv') == \
+            src.joinpath('nested/test3.csv').read_bytes()
+
+
+def test_add_dir_incremental_keeps_extras(tmp_path):
+    "should copy kept members with their extra fields when replacing others"
+    src = Path(tmp_path, 'src')
+    src.mkdir()
+    src.joinpath('changed.csv').write_text('id\n1\n')
+    pth = Path(tmp_path, 'archive.zip')
+    # Extended timestamp field, as written by Info-ZIP
+    timestamp = b'UT\x05\x00\x01\x00\x00\x00\x60'
+    with ZipFile(pth, 'w') as zfile:
+        zinfo = ZipInfo('kept.csv', date_time=(2021, 1, 1, 0, 0, 0))
+        zinfo.extra = timestamp
+        zfile.writestr(zinfo, 'id\n2\n')
+        zfile.writestr('changed.csv', 'id\n')
+    stats = Archive(pth).add_dir(src, incremental=True)
+    assert stats == {'added': 0, 'skipped': 0, 'replaced': 1}
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.namelist() == ['kept.csv', 'changed.csv']
+        assert zfile.getinfo('kept.csv').extra == timestamp
+        assert zfile.read('kept.csv') == b'id\n2\n'
+        assert zfile.read('changed.csv') == b'id\n1\n'
+
+
+def test_stream_chunks(tmp_path):
+    "should yield bytes of a valid zip without writing to disk"
+    stream = ArchiveStream(chunk_size=16)
+    stream.add(fixture_path('test.csv'), rename='foo.csv')
+    stream.add_dir(fixture_path('files/nested'))
+    chunks = list(stream)
+    assert len(chunks) > 1
+    pth = Path(tmp_path, 'streamed.zip')
+    pth.write_bytes(b''.join(chunks))
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.namelist() == ['foo.csv', 'test3.csv']
+        assert zfile.read('foo.csv') == Path(fixture_path('test.csv')).read_bytes()
+
+
+def test_stream_write_to(tmp_path):
+    "should write to non-seekable file-like objects"
+    class Sink:
+        def __init__(self):
+            self.data = b''
+
+        def write(self, data):
+            self.data += data
+    sink = Sink()
+    stream = ArchiveStream()
+    stream.add_dir(fixture_path('files'))
+    stream.write_to(sink)
+    pth = Path(tmp_path, 'streamed.zip')
+    pth.write_bytes(sink.data)
+    assert sorted(Archive(pth).list()) == \
+        ['nested/test3.csv', 'test.csv', 'test.json', 'test2.csv']
+
+
+def test_compression_policy(tmp_path):
+    "should pick compression per file and store already-compressed formats"
+    src = Path(tmp_path, 'src')
+    src.mkdir()
+    src.joinpath('data.csv').write_text('id,name\n' * 1000)
+    src.joinpath('data.gz').write_bytes(os.urandom(2048))
+    src.joinpath('random.bin').write_bytes(os.urandom(2048))
+    pth = Path(tmp_path, 'archive.zip')
+    policy = CompressionPolicy(compress_type=ZIP_BZIP2, sample_size=1024)
+    archive = Archive(pth)
+    archive.add_dir(src, compression=policy)
+    with ZipFile(pth) as zfile:
+        types = {i.filename: i.compress_type for i in zfile.infolist()}
+        assert zfile.testzip() is None
+    assert types == {
+        'data.csv': ZIP_BZIP2,
+        'data.gz': ZIP_STORED,
+        'random.bin': ZIP_STORED,
+    }
+
+
+def test_compression_policy_callable(tmp_path):
+    "should accept any callable policy, including in parallel mode"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth, compression=lambda path: (ZIP_LZMA, None))
+    archive.add_dir(fixture_path('files'), workers=2)
+    archive.add(fixture_path('test.csv'), rename='fast.csv',
+                compression=lambda path: (ZIP_DEFLATED, 1))
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+        types = {i.filename: i.compress_type for i in zfile.infolist()}
+    assert types['nested/test3.csv'] == ZIP_LZMA
+    assert types['fast.csv'] == ZIP_DEFLATED
+
+
+def test_extractall_members(tmp_path):
+    "should only extract members matching a glob or predicate"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth)
+    archive.add_dir(fixture_path('files'))
+    out = Path(tmp_path, 'out')
+    extracted = archive.extractall(path=out, members='*.csv')
+    assert sorted(extracted) == ['nested/test3.csv', 'test.csv', 'test2.csv']
+    assert not out.joinpath('test.json').exists()
+    other = Path(tmp_path, 'other')
+    extracted = archive.extractall(
+        path=other,
+        members=lambda name: name.endswith('.json')
+    )
+    assert extracted == ['test.json']
+    assert [f.name for f in other.glob('**/*')] == ['test.json']
+
+
+def test_extractall_parallel_skip_existing(tmp_path):
+    "should extract on a worker pool and skip files already on disk"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth)
+    archive.add_dir(fixture_path('files'))
+    out = Path(tmp_path, 'out')
+    extracted = archive.extractall(path=out, workers=3, skip_existing=True)
+    assert len(extracted) == 4
+    expected = Path(fixture_path('files/nested/test3.csv')).read_bytes()
+    assert out.joinpath('nested/test3.csv').read_bytes() == expected
+    out.joinpath('test.csv').write_text('changed')
+    extracted = archive.extractall(path=out, workers=3, skip_existing=True)
+    assert extracted == ['test.csv']
+    expected = Path(fixture_path('files/test.csv')).read_bytes()
+    assert out.joinpath('test.csv').read_bytes() == expected
+
+
+def test_extractall_parallel_shared_dirs(tmp_path):
+    "should not trip over workers creating the same directories"
+    pth = Path(tmp_path, 'archive.zip')
+    with ZipFile(pth, 'w') as zfile:
+        for d in range(4):
+            zfile.writestr(f'dir-{d}/', '')
+            for i in range(16):
+                zfile.writestr(f'dir-{d}/sub/file-{i}.csv', f'{d},{i}\n')
+    archive = Archive(pth)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for run in range(10):
+            out = Path(tmp_path, f'out-{run}')
+            assert len(archive.extractall(path=out, workers=32)) == 68
+    finally:
+        sys.setswitchinterval(interval)
+    assert out.joinpath('dir-3/sub/file-15.csv').read_text() == '3,15\n'
+
+
+def test_index_cache(tmp_path):
+    "should cache the member index until the zip changes"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth)
+    archive.add(fixture_path('test.csv'))
+    index = archive.index
+    assert list(index) == ['test.csv']
+    assert index['test.csv'].file_size == Path(fixture_path('test.csv')).stat().st_size
+    assert archive._infolist() is archive._infolist()
+    assert archive.index is index
+    # Changes made outside of the Archive also invalidate the cache
+    with ZipFile(pth, 'a') as zfile:
+        zfile.write(fixture_path('test2.csv'), arcname='test2.csv')
+    assert archive.list() == ['test.csv', 'test2.csv']
+    assert list(archive.index) == ['test.csv', 'test2.csv']
+
+
+def test_open_member(tmp_path):
+    "should stream a single member's bytes"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth)
+    archive.add_dir(fixture_path('files'))
+    expected = Path(fixture_path('files/nested/test3.csv')).read_bytes()
+    with archive.open('nested/test3.csv') as fh:
+        assert fh.read() == expected
+    with pytest.raises(KeyError):
+        archive.open('missing.csv')
+
+
+def test_add_data(tmp_path):
+    "should add members from bytes, file-like objects and iterators"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth)
+    archive.add_data('bytes.csv', b'id,name\n1,foo\n')
+    archive.add_data('text.json', '{"name": "foo"}')
+    with open(fixture_path('test.csv'), 'rb') as fh:
+        archive.add_data('fileobj.csv', fh)
+    rows = (f'{i},row {i}\n' for i in range(1000))
+    archive.add_data('rows.csv', rows, force_zip64=True)
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.read('bytes.csv') == b'id,name\n1,foo\n'
+        assert zfile.read('text.json') == b'{"name": "foo"}'
+        assert zfile.read('fileobj.csv') == Path(fixture_path('test.csv')).read_bytes()
+        assert zfile.read('rows.csv').decode('utf-8').splitlines()[-1] == '999,row 999'
+
+
+def test_stream_add_data(tmp_path):
+    "should stream in-memory members alongside files"
+    stream = ArchiveStream()
+    stream.add(fixture_path('test.csv'))
+    stream.add_data('rows.csv', (f'{i}\n' for i in range(3)))
+    pth = Path(tmp_path, 'streamed.zip')
+    pth.write_bytes(b''.join(stream))
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.read('rows.csv') == b'0\n1\n2\n'
+
+
+def sha256(pth):
+    return hashlib.sha256(Path(pth).read_bytes()).hexdigest()
+
+
+def test_manifest_sidecar(tmp_path):
+    "should record checksums of archived files in a sidecar file"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth, manifest='sidecar')
+    archive.add_dir(fixture_path('files'), workers=2)
+    archive.add_data('rows.csv', b'1\n2\n')
+    manifest = json.loads(Path(tmp_path, 'archive.manifest.json').read_text())
+    assert manifest == archive.read_manifest()
+    assert sorted(manifest) == \
+        ['nested/test3.csv', 'rows.csv', 'test.csv', 'test.json', 'test2.csv']
+    assert manifest['test.csv'] == {
+        'sha256': sha256(fixture_path('files/test.csv')),
+        'size': Path(fixture_path('files/test.csv')).stat().st_size,
+    }
+    assert 'manifest.json' not in archive.list()
+
+
+def test_manifest_member(tmp_path):
+    "should keep a single, up to date manifest member in the archive"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth, manifest='member')
+    archive.add(fixture_path('test.csv'))
+    archive.add(fixture_path('test2.csv'))
+    assert archive.list() == ['test.csv', 'test2.csv', 'manifest.json']
+    manifest = archive.read_manifest()
+    assert manifest['test.csv']['sha256'] == sha256(fixture_path('test.csv'))
+    assert manifest['test2.csv']['sha256'] == sha256(fixture_path('test2.csv'))
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+
+
+def test_manifest_member_kept_on_error(tmp_path):
+    "should keep the manifest member when an add fails"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth, manifest='member')
+    archive.add(fixture_path('test.csv'))
+    with pytest.raises(FileNotFoundError):
+        archive.add(str(Path(tmp_path, 'typo.csv')))
+    assert archive.list() == ['test.csv', 'manifest.json']
+    assert sorted(archive.read_manifest()) == ['test.csv']
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+
+
+def test_manifest_member_name_collision(tmp_path):
+    "should refuse files named like the manifest unless it is renamed"
+    src = Path(tmp_path, 'src')
+    src.mkdir()
+    src.joinpath('data.csv').write_text('id\n1\n')
+    src.joinpath('manifest.json').write_text('{"source": "scraper"}')
+    pth = Path(tmp_path, 'archive.zip')
+    with pytest.raises(ValueError, match='manifest_name'):
+        Archive(pth, manifest='member').add_dir(src)
+    with pytest.raises(ValueError, match='manifest_name'):
+        ArchiveStream(manifest=True).add_dir(src)
+    pth.unlink()
+    archive = Archive(pth, manifest='member', manifest_name='checksums.json')
+    archive.add_dir(src)
+    archive.add_data('more.csv', 'id\n2\n')
+    assert sorted(archive.list()) == \
+        ['checksums.json', 'data.csv', 'manifest.json', 'more.csv']
+    assert sorted(archive.read_manifest()) == ['data.csv', 'manifest.json', 'more.csv']
+    with archive.open('manifest.json') as fh:
+        assert fh.read() == b'{"source": "scraper"}'
+
+
+def test_add_directory_entry(tmp_path):
+    "should store a directory as a directory entry"
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth)
+    archive.add(fixture_path('files/nested'))
+    assert archive.list() == ['nested/']
+
+
+def test_stream_manifest(tmp_path):
+    "should append a manifest member to streamed archives"
+    stream = ArchiveStream(manifest=True)
+    stream.add(fixture_path('test.csv'))
+    pth = Path(tmp_path, 'streamed.zip')
+    pth.write_bytes(b''.join(stream))
+    archive = Archive(pth)
+    assert archive.list() == ['test.csv', 'manifest.json']
+    assert archive.read_manifest()['test.csv']['sha256'] == sha256(fixture_path('test.csv'))
+
+
+def test_add_dir_volumes(tmp_path):
+    "should split files into balanced, independently readable volumes"
+    src = Path(tmp_path, 'src')
+    src.mkdir()
+    for i in range(10):
+        src.joinpath(f'data{i}.bin').write_bytes(os.urandom(1000 * (i + 1)))
+    archive = Archive(Path(tmp_path, 'archive.zip'))
+    # Leftover from a previous, larger split
+    stale = Path(tmp_path, 'archive.009.zip')
+    stale.write_bytes(b'')
+    volumes = archive.add_dir_volumes(src, max_size=20000, workers=2)
+    assert len(volumes) == 3
+    assert [v.path.name for v in volumes] == \
+        ['archive.001.zip', 'archive.002.zip', 'archive.003.zip']
+    assert not stale.exists()
+    names = []
+    for volume in volumes:
+        assert volume.path.stat().st_size <= 20000
+        with ZipFile(volume.path) as zfile:
+            assert zfile.testzip() is None
+        names.extend(volume.list())
+    assert sorted(names) == sorted(f'data{i}.bin' for i in range(10))
+
+
+def test_add_dir_volumes_compressed_sizes(tmp_path):
+    "should pack volumes by compressed rather than raw file size"
+    src = Path(tmp_path, 'src')
+    src.mkdir()
+    # Each file is bigger than a volume, but compresses to a fraction of it
+    for i in range(6):
+        rows = ''.join(f'{n % 100},CA,{i}\n' for n in range(10000))
+        src.joinpath(f'data{i}.csv').write_text(rows)
+        assert src.joinpath(f'data{i}.csv').stat().st_size > 60000
+    archive = Archive(Path(tmp_path, 'archive.zip'), manifest='member')
+    volumes = archive.add_dir_volumes(src, max_size=60000, workers=2)
+    assert len(volumes) == 1
+    assert volumes[0].path.stat().st_size <= 60000
+    assert sorted(volumes[0].list()) == \
+        ['data0.csv', 'data1.csv', 'data2.csv', 'data3.csv', 'data4.csv', 'data5.csv', 'manifest.json']
+    manifest = volumes[0].read_manifest()
+    assert manifest['data3.csv']['sha256'] == sha256(src.joinpath('data3.csv'))
+
+
+@pytest.mark.parametrize('compress_type', [ZIP_BZIP2, ZIP_LZMA])
+@pytest.mark.parametrize('manifest', [None, 'member'])
+def test_add_dir_volumes_other_codecs(tmp_path, compress_type, manifest):
+    "should keep volumes under the limit when the codec grows incompressible data"
+    src = Path(tmp_path, 'src')
+    src.mkdir()
+    # Each fills most of a volume, leaving less room than bzip2 adds
+    for i in range(3):
+        src.joinpath(f'data{i}').write_bytes(os.urandom(19600))
+    src.joinpath('text.csv').write_text('id\n' * 2000)
+    policy = CompressionPolicy(compress_type, store_extensions=(), sample_size=0)
+    archive = Archive(Path(tmp_path, 'archive.zip'), compression=policy, manifest=manifest)
+    volumes = archive.add_dir_volumes(src, max_size=20000)
+    names = []
+    for volume in volumes:
+        assert volume.path.stat().st_size <= 20000
+        with ZipFile(volume.path) as zfile:
+            assert zfile.testzip() is None
+            for info in zfile.infolist():
+                if info.filename == 'text.csv':
+                    assert info.compress_type == compress_type
+        names.extend(volume.list())
+    assert 'text.csv' in names
+
+
+def test_add_tree(tmp_path, source_repo):
+    "should archive a git tree straight from the object store"
+    bare = tmp_path.joinpath('bare.git')
+    subprocess.check_output(['git', 'clone', '--bare', str(source_repo), str(bare)])
+    repo = Repository(str(bare))
+    pth = Path(tmp_path, 'archive.zip')
+    archive = Archive(pth)
+    assert archive.add_tree(repo) == 4
+    assert sorted(archive.list()) == \
+        ['README.md', 'data/a.csv', 'data/b.csv', 'docs/notes.txt']
+    with archive.open('data/b.csv') as fh:
+        assert fh.read() == b'id\n2\n'
+    # Older commits, path filters and drop_root naming
+    archive.add_tree(repo, 'HEAD~1', paths=['data'], drop_root='data', mode='w')
+    assert archive.list() == ['a.csv']
+    archive.add_tree(repo, pattern='*.csv', mode='w')
+    assert archive.list() == ['data/a.csv', 'data/b.csv']
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
@@ -0,0 +1,93 @@
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+
+from bln_etl import RepositoryManager
+
+
+def test_sync_clones_and_pulls(tmp_path, source_repo):
+    "should clone missing repos and pull existing ones"
+    url = source_repo.as_uri()
+    paths = [str(tmp_path.joinpath(f'clone-{i}')) for i in range(3)]
+    manager = RepositoryManager(concurrency=2, timeout=60)
+    results = manager.sync([(path, url) for path in paths])
+    assert [r.action for r in results] == ['clone'] * 3
+    assert all(r.ok for r in results)
+    assert [r.path for r in results] == paths
+    assert Path(paths[0], 'data', 'b.csv').exists()
+    results = manager.sync([(path, url) for path in paths])
+    assert [r.action for r in results] == ['pull'] * 3
+    assert all(r.ok for r in results)
+    results = manager.sync([(paths[0], url)], fetch_only=True)
+    assert results[0].action == 'fetch'
+    assert results[0].ok
+
+
+def test_sync_collects_failures(tmp_path, source_repo):
+    "should report failures per repo instead of raising"
+    good = str(tmp_path.joinpath('good'))
+    bad = str(tmp_path.joinpath('bad'))
+    missing = tmp_path.joinpath('does-not-exist').as_uri()
+    manager = RepositoryManager()
+    results = manager.sync([(good, source_repo.as_uri()), (bad, missing)], depth=1)
+    assert results[0].ok is True
+    assert results[1].ok is False
+    assert results[1].error
+
+
+def test_sync_timeout(tmp_path, source_repo):
+    "should stop commands that run past the timeout"
+    manager = RepositoryManager(timeout=0)
+    results = manager.sync([(str(tmp_path.joinpath('slow')), source_repo.as_uri())])
+    assert results[0].ok is False
+    assert 'timed out' in results[0].error
+
+
+def test_sync_os_errors(tmp_path, source_repo):
+    "should report paths that can't be created as failures"
+    afile = tmp_path.joinpath('afile')
+    afile.write_text('not a directory')
+    good = str(tmp_path.joinpath('good'))
+    bad = str(afile.joinpath('sub'))
+    manager = RepositoryManager(timeout=60)
+    results = manager.sync([(good, source_repo.as_uri()), (bad, source_repo.as_uri())])
+    assert results[0].ok is True
+    assert results[1].ok is False
+    assert results[1].action == 'clone'
+    assert 'Not a directory' in results[1].error
+    results = manager.sync([(bad, source_repo.as_uri())])
+    assert results[0].ok is False
+
+
+def test_sync_missing_git(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path.joinpath('empty-bin')))
+    results = RepositoryManager().sync([(str(tmp_path.joinpath('repo')), 'unused')])
+    assert results[0].ok is False
+    assert results[0].error
+
+
+def test_sync_cancel_kills_git(tmp_path, monkeypatch):
+    "should kill running git commands when the sync is cancelled"
+    bin_dir = tmp_path.joinpath('bin')
+    bin_dir.mkdir()
+    pid_file = tmp_path.joinpath('git.pid')
+    git = bin_dir.joinpath('git')
+    git.write_text(f'#!/bin/sh\necho $$ > {pid_file}\nexec sleep 30\n')
+    git.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    async def main():
+        manager = RepositoryManager()
+        task = asyncio.ensure_future(manager.sync_async([(str(tmp_path.joinpath('repo')), 'unused')]))
+        while not pid_file.exists() or not pid_file.read_text().strip():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    pid = int(pid_file.read_text())
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
@@ -0,0 +1,111 @@
+import os
+import shutil
+import subprocess
+import threading
+
+from bln_etl import MirrorCache, Repository
+
+
+def test_clone_borrows_from_mirror(tmp_path, source_repo):
+    "should create a bare mirror and borrow its objects when cloning"
+    cache = MirrorCache(tmp_path.joinpath('cache'))
+    url = str(source_repo)
+    dest = tmp_path.joinpath('workspace')
+    repo = cache.clone(url, dest)
+    mirror = cache.mirror_path(url)
+    assert mirror.joinpath('HEAD').exists()
+    assert repo.initialized is True
+    assert dest.joinpath('data', 'b.csv').exists()
+    alternates = dest.joinpath('.git', 'objects', 'info', 'alternates').read_text()
+    assert str(mirror) in alternates
+
+
+def test_update_fetches_new_commits(tmp_path, source_repo):
+    "should fetch new commits into an existing mirror"
+    cache = MirrorCache(tmp_path.joinpath('cache'))
+    url = str(source_repo)
+    mirror = cache.update(url)
+    source_repo.joinpath('new.csv').write_text('id\n9\n')
+    subprocess.check_output(['git', 'add', '.'], cwd=str(source_repo))
+    subprocess.check_output(['git', 'commit', '-m', 'New'], cwd=str(source_repo))
+    assert cache.update(url) == mirror
+    log = subprocess.check_output(['git', 'log', '--format=%s', '-1'], cwd=str(mirror))
+    assert log.decode('utf-8').strip() == 'New'
+
+
+def test_evict_least_recently_used(tmp_path, source_repo):
+    "should evict least recently used mirrors past the disk budget"
+    other = tmp_path.joinpath('other-repo')
+    shutil.copytree(str(source_repo), str(other))
+    cache = MirrorCache(tmp_path.joinpath('cache'))
+    cache.update(str(source_repo))
+    first = cache.mirror_path(str(source_repo))
+    os.utime(str(first), (0, 0))
+    cache.max_bytes = cache.size() + 1
+    dest = tmp_path.joinpath('workspace')
+    repo = cache.clone(str(other), dest, dissociate=True)
+    assert not first.exists()
+    assert cache.mirrors() == [cache.mirror_path(str(other))]
+    assert not dest.joinpath('.git', 'objects', 'info', 'alternates').exists()
+    # Dissociated clones keep working without the mirror
+    subprocess.check_output(['git', 'fsck'], cwd=str(dest))
+    assert repo.initialized is True
+
+
+def test_evict_skips_mirrors_in_use(tmp_path, source_repo, monkeypatch):
+    "should not evict a mirror that another thread is cloning from"
+    other = tmp_path.joinpath('other-repo')
+    shutil.copytree(str(source_repo), str(other))
+    cache = MirrorCache(tmp_path.joinpath('cache'), max_bytes=1)
+    cloning = threading.Event()
+    resume = threading.Event()
+    clone_to_dir = Repository.clone_to_dir
+
+    def slow_clone(url, dir, **options):
+        cloning.set()
+        assert resume.wait(10)
+        return clone_to_dir(url, dir, **options)
+
+    monkeypatch.setattr(Repository, 'clone_to_dir', staticmethod(slow_clone))
+    dest = tmp_path.joinpath('workspace')
+    thread = threading.Thread(target=cache.clone, args=(str(source_repo), dest))
+    thread.start()
+    try:
+        assert cloning.wait(10)
+        cache.update(str(other))
+        assert cache.mirror_path(str(source_repo)).exists()
+    finally:
+        resume.set()
+        thread.join()
+    subprocess.check_output(['git', 'fsck'], cwd=str(dest))
+    # Once the clone is done, the mirror can go
+    cache.update(str(other))
+    assert cache.mirrors() == [cache.mirror_path(str(other))]
+
+
+def test_updates_of_other_remotes_run_concurrently(tmp_path, source_repo, monkeypatch):
+    "should not hold up one remote's fetch behind another's"
+    other = tmp_path.joinpath('other-repo')
+    shutil.copytree(str(source_repo), str(other))
+    cache = MirrorCache(tmp_path.joinpath('cache'))
+    fetching = threading.Event()
+    resume = threading.Event()
+    check_output = subprocess.check_output
+
+    def slow_fetch(args, **kwargs):
+        if str(source_repo) in args:
+            fetching.set()
+            assert resume.wait(10)
+        return check_output(args, **kwargs)
+
+    monkeypatch.setattr('bln_etl.mirror.subprocess.check_output', slow_fetch)
+    thread = threading.Thread(target=cache.update, args=(str(source_repo),))
+    thread.start()
+    try:
+        assert fetching.wait(10)
+        # Finishes while the first fetch is still going
+        assert cache.update(str(other)).exists()
+    finally:
+        resume.set()
+        thread.join()
+    assert cache.mirror_path(str(source_repo)).exists()
@@ -1,5 +1,7 @@
 import os
 import re
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 
 import pytest
@@ -8,6 +10,8 @@ from .conftest import repo_status, repo_log
 from bln_etl import Repository
 
 
+COMMIT_OUTPUT = b'[main (root-commit) 1a2b3c4] Initial commit\n 1 file changed, 1 insertion(+)\n'
+
 
 def test_clone_to_dir(git_project_dir):
     "should clone to specified directory"
@@ -24,7 +28,10 @@ def test_clone(git_project_dir):
     with mock.patch('bln_etl.repository.subprocess.check_output') as check_output:
         with Repository(git_project_dir) as repo:
             repo.clone(repo_url)
-        check_output.assert_called_once_with(['git', 'clone', repo_url, '.'])
+        check_output.assert_called_once_with(
+            ['git', 'clone', repo_url, '.'],
+            cwd=git_project_dir
+        )
 
 def test_init(git_project_dir):
     with Repository(git_project_dir) as repo:
@@ -33,18 +40,20 @@ def test_init(git_project_dir):
         assert repo.initialized is True
 
 def test_directory_management(git_project_dir):
+    "should create the repo dir without changing the working directory"
     current_dir = os.getcwd()
     with Repository(git_project_dir) as repo:
-        assert os.getcwd().endswith('fake-repo')
+        assert os.path.isdir(git_project_dir)
+        assert os.getcwd() == current_dir
     assert os.getcwd() == current_dir
 
 @pytest.mark.usefixtures('init_repo', 'create_readme')
 def test_add_untracked(git_project_dir):
     p = "Untracked files.*?README.md"
     with Repository(git_project_dir) as repo:
-        assert re.search(p, repo_status(), re.DOTALL)
+        assert re.search(p, repo_status(git_project_dir), re.DOTALL)
         repo.add()
-        assert "new file:   README.md" in repo_status()
+        assert "new file:   README.md" in repo_status(git_project_dir)
 
 @pytest.mark.usefixtures(
     'init_repo',
@@ -54,7 +63,7 @@ def test_add_untracked(git_project_dir):
 def test_commit(git_project_dir):
     with Repository(git_project_dir) as repo:
         repo.commit("Initial commit")
-        assert 'Initial commit' in repo_log()
+        assert 'Initial commit' in repo_log(git_project_dir)
 
 @pytest.mark.usefixtures('init_repo')
 def test_add_remote(git_project_dir):
@@ -62,7 +71,10 @@ def test_add_remote(git_project_dir):
     with mock.patch('bln_etl.repository.subprocess.check_output') as check_output:
         with Repository(git_project_dir) as repo:
             repo.add_remote(repo_url)
-        check_output.assert_called_once_with(['git', 'remote', 'add', 'origin', repo_url])
+        check_output.assert_called_once_with(
+            ['git', 'remote', 'add', 'origin', repo_url],
+            cwd=git_project_dir
+        )
 
 @pytest.mark.usefixtures(
     'init_repo',
@@ -73,11 +85,13 @@ def test_push(git_project_dir):
     repo_url = 'git@github.com:biglocalnews/bln-etl.git'
     patch_target = 'bln_etl.repository.subprocess.check_output'
     with mock.patch(patch_target) as check_output:
+        check_output.return_value = COMMIT_OUTPUT
         with Repository(git_project_dir) as repo:
             repo.commit('Initial commit')
             repo.push()
             expected_calls = [
                 (['git', 'commit', '-m', 'Initial commit'],),
+                (['git', 'show', '--shortstat', '--format=%H', 'HEAD'],),
                 (['git', 'push', '-u', 'origin', 'main'],)
             ]
             actual_calls = [call[1] for call in check_output.mock_calls]
@@ -92,13 +106,145 @@ def test_pull(git_project_dir):
     repo_url = 'git@github.com:biglocalnews/bln-etl.git'
     patch_target = 'bln_etl.repository.subprocess.check_output'
     with mock.patch(patch_target) as check_output:
+        check_output.return_value = COMMIT_OUTPUT
         with Repository(git_project_dir) as repo:
             repo.commit('Initial commit')
             repo.pull()
             expected_calls = [
-                mock.call(['git', 'commit', '-m', 'Initial commit']),
-                mock.call(['git', 'pull'])
+                mock.call(['git', 'commit', '-m', 'Initial commit'], cwd=git_project_dir),
+                mock.call(['git', 'show', '--shortstat', '--format=%H', 'HEAD'], cwd=git_project_dir),
+                mock.call(['git', 'pull'], cwd=git_project_dir)
             ]
             #actual_calls = [call[1] for call in check_output.mock_calls]
             assert check_output.mock_calls == expected_calls
 
+
+def test_threaded_repositories(tmp_path):
+    "should work on several repositories at once from threads"
+    paths = [str(tmp_path.joinpath(f'repo-{i}')) for i in range(5)]
+
+    def init(path):
+        with Repository(path) as repo:
+            repo.init()
+            return repo.initialized
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        assert list(executor.map(init, paths)) == [True] * 5
+    for path in paths:
+        assert os.path.isdir(os.path.join(path, '.git'))
+
+
+def test_clone_options():
+    "should build clone arguments from options"
+    repo_url = 'git@github.com:biglocalnews/bln-etl.git'
+    patch_target = 'bln_etl.repository.subprocess.check_output'
+    with mock.patch(patch_target) as check_output:
+        Repository.clone_to_dir(
+            repo_url,
+            '/tmp/etl',
+            depth=1,
+            branch='main',
+            single_branch=True,
+            filter='blob:none'
+        )
+        check_output.assert_called_once_with([
+            'git', 'clone', '--depth', '1', '--branch', 'main',
+            '--single-branch', '--filter=blob:none', repo_url, '/tmp/etl'
+        ])
+
+
+def test_clone_shallow_partial(source_repo, git_project_dir):
+    "should make depth-limited, blobless clones"
+    with Repository(git_project_dir) as repo:
+        repo.clone(source_repo.as_uri(), depth=1, filter='blob:none')
+        assert repo.initialized is True
+        count = repo._git('rev-list', '--count', 'HEAD').decode('utf-8').strip()
+        assert count == '1'
+        config = repo._git('config', 'remote.origin.partialclonefilter')
+        assert config.decode('utf-8').strip() == 'blob:none'
+
+
+def test_clone_sparse(source_repo, git_project_dir):
+    "should only check out requested paths"
+    Repository.clone_to_dir(source_repo.as_uri(), git_project_dir, sparse_paths=['data'])
+    checked_out = sorted(
+        str(p.relative_to(git_project_dir))
+        for p in Path(git_project_dir).glob('**/*')
+        if '.git' not in p.parts
+    )
+    assert checked_out == ['README.md', 'data', 'data/a.csv', 'data/b.csv']
+
+
+def test_changes(source_repo):
+    "should list added, modified and deleted paths between commits"
+    with Repository(str(source_repo)) as repo:
+        first = repo._git('rev-parse', 'HEAD~1').decode('utf-8').strip()
+        source_repo.joinpath('data', 'a.csv').write_text('id\n1\n3\n')
+        source_repo.joinpath('README.md').unlink()
+        repo.add()
+        repo.commit('Update data')
+        changes = repo.changes(first)
+    assert changes == {
+        'added': ['data/b.csv', 'docs/notes.txt'],
+        'modified': ['data/a.csv'],
+        'deleted': ['README.md'],
+    }
+
+
+def test_changes_since_sync(source_repo):
+    "should report changes since the last recorded sync point"
+    with Repository(str(source_repo)) as repo:
+        assert repo.sync_state() is None
+        changes = repo.changes_since_sync()
+        assert sorted(changes['added']) == \
+            ['README.md', 'data/a.csv', 'data/b.csv', 'docs/notes.txt']
+        state = repo.mark_synced()
+        assert state['commit'] == repo.head()
+        assert source_repo.joinpath('.git', 'bln_etl_sync.json').exists()
+        assert repo.changes_since_sync() == {'added': [], 'modified': [], 'deleted': []}
+        source_repo.joinpath('data', 'c.csv').write_text('id\n3\n')
+        repo.add()
+        repo.commit('More data')
+        assert repo.changes_since_sync()['added'] == ['data/c.csv']
+
+
+def test_add_commit_paths(source_repo):
+    "should only stage and commit the given paths"
+    with Repository(str(source_repo)) as repo:
+        source_repo.joinpath('data', 'a.csv').write_text('id\n1\n2\n3\n')
+        source_repo.joinpath('data', 'new [1].csv').write_text('id\n1\n')
+        source_repo.joinpath('docs', 'notes.txt').write_text('Untouched')
+        result = repo.commit('Update data', paths=['data/a.csv', 'data/new [1].csv'])
+        assert result == {
+            'hash': repo.head(),
+            'branch': 'main',
+            'files_changed': 2,
+            'insertions': 4,
+            'deletions': 0,
+        }
+        status = repo_status(str(source_repo))
+        assert 'docs/notes.txt' in status
+        assert 'data/' not in status
+        # Nothing to do for an empty list
+        assert repo.add([]) == b''
+
+
+def test_commit_empty_paths(source_repo):
+    "should refuse to commit an empty list of paths"
+    with Repository(str(source_repo)) as repo:
+        source_repo.joinpath('docs', 'notes.txt').write_text('Staged')
+        repo.add(['docs/notes.txt'])
+        head = repo.head()
+        with pytest.raises(ValueError):
+            repo.commit('Nothing', paths=[])
+        assert repo.head() == head
+        assert 'docs/notes.txt' in repo_status(str(source_repo))
+
+
+def test_commit_stats_ignore_message(source_repo):
+    "should not read counts from the commit message"
+    with Repository(str(source_repo)) as repo:
+        source_repo.joinpath('data', 'a.csv').write_text('id\n1\n2\n')
+        result = repo.commit('Drop 5 deletions from 9 files', paths=['data/a.csv'])
+    assert result['files_changed'] == 1
+    assert result['insertions'] == 1
+    assert result['deletions'] == 0
@@ -0,0 +1,144 @@
+import io
+import zlib
+from zipfile import BadZipFile, ZipFile, ZipInfo, ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED
+
+import pytest
+from bln_etl import _zipcompat
+
+
+CONTENT = b'id,name\n' + b''.join(b'%d,row %d\n' % (i, i) for i in range(500))
+
+
+def compressed(compress_type, data=CONTENT, compresslevel=None):
+    zinfo = ZipInfo('data.csv', date_time=(2021, 1, 1, 0, 0, 0))
+    _zipcompat.set_compression(zinfo, compress_type, compresslevel)
+    compressor = _zipcompat.get_compressor(compress_type, compresslevel)
+    if compressor:
+        body = compressor.compress(data) + compressor.flush()
+    else:
+        body = data
+    zinfo.file_size = len(data)
+    zinfo.compress_size = len(body)
+    zinfo.CRC = zlib.crc32(data)
+    return zinfo, io.BytesIO(body)
+
+
+@pytest.mark.parametrize('compress_type', [ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA])
+def test_write_compressed(tmp_path, compress_type):
+    "should write members compressed outside of ZipFile"
+    pth = tmp_path.joinpath('archive.zip')
+    with ZipFile(pth, 'w') as zfile:
+        zfile.writestr('first.txt', 'first')
+        _zipcompat.write_compressed(zfile, *compressed(compress_type), chunk_size=100)
+        zfile.writestr('last.txt', 'last')
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.namelist() == ['first.txt', 'data.csv', 'last.txt']
+        assert zfile.getinfo('data.csv').compress_type == compress_type
+        assert zfile.read('data.csv') == CONTENT
+
+
+def test_set_compression_level(tmp_path):
+    "should set a level that ZipFile honors when writing"
+    sizes = []
+    for level in [0, 9]:
+        pth = tmp_path.joinpath(f'level-{level}.zip')
+        zinfo = ZipInfo('data.csv')
+        _zipcompat.set_compression(zinfo, ZIP_DEFLATED, level)
+        with ZipFile(pth, 'w') as zfile:
+            zfile.writestr(zinfo, CONTENT)
+        with ZipFile(pth) as zfile:
+            assert zfile.read('data.csv') == CONTENT
+            sizes.append(zfile.getinfo('data.csv').compress_size)
+    assert sizes[0] > sizes[1]
+
+
+def test_write_compressed_short_data(tmp_path):
+    "should refuse data shorter than the member's compressed size"
+    zinfo, data = compressed(ZIP_DEFLATED)
+    zinfo.compress_size += 10
+    with ZipFile(tmp_path.joinpath('archive.zip'), 'w') as zfile:
+        with pytest.raises(EOFError):
+            _zipcompat.write_compressed(zfile, zinfo, data, chunk_size=100)
+
+
+def test_write_compressed_open_handle(tmp_path):
+    "should refuse to write while another write handle is open"
+    with ZipFile(tmp_path.joinpath('archive.zip'), 'w') as zfile:
+        with zfile.open('open.txt', 'w'):
+            with pytest.raises(ValueError):
+                _zipcompat.write_compressed(zfile, *compressed(ZIP_DEFLATED), chunk_size=100)
+
+
+@pytest.mark.parametrize('position', [0, -1])
+def test_remove_member(tmp_path, position):
+    "should drop a member from a zip open in append mode"
+    pth = tmp_path.joinpath('archive.zip')
+    names = ['a.txt', 'b.txt', 'c.txt']
+    with ZipFile(pth, 'w') as zfile:
+        for name in names:
+            zfile.writestr(name, name * 100)
+    size = pth.stat().st_size
+    removed = names[position]
+    with ZipFile(pth, 'a') as zfile:
+        _zipcompat.remove_member(zfile, zfile.getinfo(removed))
+        zfile.writestr('d.txt', 'd')
+    with ZipFile(pth) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.namelist() == [n for n in names if n != removed] + ['d.txt']
+        assert zfile.read('d.txt') == b'd'
+    if position == -1:
+        # The last member's space is reused
+        assert pth.stat().st_size < size
+
+
+def test_copy_member(tmp_path):
+    "should copy members as-is, including ones written with data descriptors"
+    src_path = tmp_path.joinpath('src.zip')
+
+    # Writing to a non-seekable stream adds data descriptors
+    class Sink:
+        def __init__(self):
+            self.chunks = []
+
+        def write(self, data):
+            self.chunks.append(bytes(data))
+            return len(data)
+
+        def flush(self):
+            pass
+
+    sink = Sink()
+    with ZipFile(sink, 'w', compression=ZIP_DEFLATED) as zfile:
+        zinfo = ZipInfo('data.csv', date_time=(2021, 1, 1, 0, 0, 0))
+        zinfo.extra = b'UT\x05\x00\x01\x00\x00\x00\x60'
+        zfile.writestr(zinfo, CONTENT)
+        zfile.writestr('other.txt', 'other')
+    src_path.write_bytes(b''.join(sink.chunks))
+    dest_path = tmp_path.joinpath('dest.zip')
+    with ZipFile(src_path) as src, ZipFile(dest_path, 'w') as dest:
+        assert src.getinfo('data.csv').flag_bits & _zipcompat.FLAG_DATA_DESCRIPTOR
+        for info in src.infolist():
+            _zipcompat.copy_member(src, info, dest, chunk_size=100)
+    with ZipFile(dest_path) as zfile:
+        assert zfile.testzip() is None
+        assert zfile.read('data.csv') == CONTENT
+        assert zfile.read('other.txt') == b'other'
+        assert zfile.getinfo('data.csv').extra == b'UT\x05\x00\x01\x00\x00\x00\x60'
+
+
+def test_seek_member_data_bad_header(tmp_path):
+    zinfo = ZipInfo('data.csv')
+    zinfo.header_offset = 0
+    with pytest.raises(BadZipFile):
+        _zipcompat.seek_member_data(io.BytesIO(b'\x00' * 40), zinfo)
+
+
+def test_strip_extra():
+    "should drop only fields with the given header id"
+    zip64 = b'\x01\x00\x08\x00' + b'\xff' * 8
+    timestamp = b'UT\x05\x00\x01\x00\x00\x00\x60'
+    assert _zipcompat.strip_extra(zip64 + timestamp, 1) == timestamp
+    assert _zipcompat.strip_extra(timestamp + zip64, 1) == timestamp
+    assert _zipcompat.strip_extra(timestamp + b'\x00', 1) == timestamp + b'\x00'
+    assert _zipcompat.strip_extra(b'', 1) == b''